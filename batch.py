@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+import sys
+import csv
+import time
+import random
+import argparse
+import multiprocessing
+import numpy as np
+from world import World
+import headless
+import rclient
+
+# Seeds other than 0 move each robot's start by up to this much (position units, degrees)
+START_JITTER = (10.0, 10.0, 15.0)
+JITTER_ATTEMPTS = 20
+FIELDS = ['scene', 'controller', 'seed', 'robots', 'steps', 'sim_time', 'wall_time', 'distance', 'collided',
+          'collision_time', 'sensor_calls', 'sensor_hits', 'scan_calls', 'x', 'y', 'angle']
+
+
+def jitter_start(world, seed):
+    # Seed 0 keeps the scene's start poses; other seeds perturb them, retrying until no robot starts in contact
+    if seed == 0:
+        return
+    rng = np.random.default_rng(seed)
+    start = world.start_pose.copy()
+    for attempt in range(JITTER_ATTEMPTS):
+        poses = start + rng.uniform(-1, 1, start.shape) * START_JITTER
+        for robot, pose in zip(world.robots, poses.tolist()):
+            robot.set_start_pose(*pose)
+        if not world.find_contacts(np.arange(len(world.robots))).any():
+            return
+    for robot, pose in zip(world.robots, start.tolist()):
+        robot.set_start_pose(*pose)
+
+
+def run_episode(scene, controller='simrobot', seed=0, time_limit=60.0, dt=0.01):
+    random.seed(seed)
+    np.random.seed(seed)
+    world = World()
+    world.load_scene(scene)
+    jitter_start(world, seed)
+    rclient.simhook = world.robots
+    module = headless.load_controller(controller, fresh=True)
+    # Controllers with randomness of their own can take the seed too
+    if hasattr(module, 'seed'):
+        module.seed(seed)
+    start = time.time()
+    steps = headless.run(world, module, time_limit, dt)
+    robot = world.robot
+    pos = robot.pos
+    return {'scene': scene, 'controller': controller, 'seed': seed, 'robots': len(world.robots), 'steps': steps,
+            'sim_time': round(world.time, 6), 'wall_time': round(time.time() - start, 6),
+            'distance': round(float(world.distance.sum()), 3), 'collided': int(world.collided.sum()),
+            'collision_time': '' if np.isnan(robot.collision_time) else round(robot.collision_time, 6),
+            'sensor_calls': int(world.sensor_calls.sum()), 'sensor_hits': int(world.sensor_hits.sum()),
+            'scan_calls': int(world.scan_calls.sum()),
+            'x': round(pos.x, 3), 'y': round(pos.y, 3), 'angle': round(robot.angle, 3)}
+
+
+def run_task(task):
+    return run_episode(*task)
+
+
+def run_batch(scenes, controller='simrobot', seeds=(0,), time_limit=60.0, dt=0.01, workers=None):
+    tasks = [(scene, controller, seed, time_limit, dt) for scene in scenes for seed in seeds]
+    if workers == 1:
+        return [run_task(t) for t in tasks]
+    with multiprocessing.Pool(workers) as pool:
+        return pool.map(run_task, tasks, chunksize=1)
+
+
+def write_results(results, f):
+    writer = csv.DictWriter(f, fieldnames=FIELDS)
+    writer.writeheader()
+    writer.writerows(results)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run headless episodes in parallel and collect metrics')
+    parser.add_argument('scenes', nargs='+', help='Scene files')
+    parser.add_argument('--controller', default='simrobot', help='Controller module name or .py path')
+    parser.add_argument('--seeds', type=int, default=1, help='Number of seeds per scene (0 .. N-1)')
+    parser.add_argument('--time-limit', type=float, default=60.0, help='Simulated seconds per episode')
+    parser.add_argument('--dt', type=float, default=0.01, help='Simulation step in seconds')
+    parser.add_argument('--workers', type=int, default=None, help='Worker processes (default: all cores)')
+    parser.add_argument('--output', default='', help='Write the results table to this CSV file')
+    args = parser.parse_args(argv)
+
+    start = time.time()
+    results = run_batch(args.scenes, args.controller, range(args.seeds), args.time_limit, args.dt, args.workers)
+    if args.output:
+        with open(args.output, 'w', newline='') as f:
+            write_results(results, f)
+    else:
+        write_results(results, sys.stdout)
+    crashed = sum(1 for r in results if r['collided'])
+    print('{} episodes, {} crashed, {:.2f} s'.format(len(results), crashed, time.time() - start), file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+import sys
+import os
+import time
+import json
+import platform
+import argparse
+import tempfile
+import numpy as np
+from world import World
+import scenegen
+import scenefile
+
+
+def measure(fn, repeat):
+    # Per-call wall time in microseconds over repeat calls
+    samples = np.empty(repeat)
+    for i in range(repeat):
+        t = time.perf_counter()
+        fn()
+        samples[i] = time.perf_counter() - t
+    samples *= 1e6
+    return {'mean_us': round(float(samples.mean()), 3), 'median_us': round(float(np.median(samples)), 3),
+            'min_us': round(float(samples.min()), 3)}
+
+
+def bench_load(path, repeat):
+    cache_path = path + scenefile.CACHE_SUFFIX
+
+    def cold():
+        if os.path.exists(cache_path):
+            os.remove(cache_path)
+        World().load_scene(path)
+
+    world = World()
+    return {'load_cold': measure(cold, max(1, repeat // 10)),
+            'load_cached': measure(lambda: world.load_scene(path), max(1, repeat // 10))}
+
+
+def bench_world(path, repeat, dt, field=0.0):
+    world = World()
+    world.set_field_resolution(field)
+    world.load_scene(path)
+    robot = world.robot
+    results = {}
+    robot.velocity = (100, 80)
+    results['robot_advance'] = measure(lambda: robot.advance(dt), repeat)
+    robot.restart()
+    results['check_intersections'] = measure(world.check_intersections, repeat)
+    angles = iter(np.tile(np.linspace(-45, 45, 91), repeat // 91 + 1).tolist())
+
+    def sense():
+        # The angles repeat at a fixed pose, so the cache is cleared to time the ray cast itself
+        robot.set_sensor_angle(next(angles))
+        world.sensor_cache.clear()
+        robot.command_sensor([])
+
+    results['command_sensor'] = measure(sense, repeat)
+    results['command_sensor_cached'] = measure(lambda: robot.command_sensor([]), repeat)
+    robot.velocity = (0, 0)
+    results['world_advance'] = measure(lambda: world.advance(dt), repeat)
+    return results
+
+
+def bench_paint(app, path, repeat):
+    from PyQt5 import QtGui
+    import pyrobsim
+    sandbox = pyrobsim.SandboxWidget(port=0)
+    sandbox.resize(800, 600)
+    sandbox.load_scene(path)
+    image = QtGui.QImage(sandbox.size(), QtGui.QImage.Format_ARGB32)
+
+    def cold():
+        sandbox.tiles.clear()
+        sandbox.render(image)
+
+    results = {'paint_cold': measure(cold, max(1, repeat // 10)),
+               'paint': measure(lambda: sandbox.render(image), repeat)}
+    sandbox.shutdown()
+    return results
+
+
+def generate(kind, size, directory):
+    path = os.path.join(directory, '{}{}.scene'.format(kind, size))
+    if kind == 'maze':
+        obstacles, poses = scenegen.maze(size, size)
+    else:
+        obstacles, poses = scenegen.clutter(size, extent=100.0 * np.sqrt(size))
+    scenegen.save_scene(path, obstacles, poses)
+    return path, len(obstacles)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Time the simulator on generated scenes of growing size')
+    parser.add_argument('--maze-sizes', type=int, nargs='*', default=[5, 10, 20, 40, 80],
+                        help='Maze side lengths in cells')
+    parser.add_argument('--clutter-sizes', type=int, nargs='*', default=[100, 1000, 10000],
+                        help='Numbers of clutter boxes')
+    parser.add_argument('--repeat', type=int, default=500, help='Calls per timed operation')
+    parser.add_argument('--dt', type=float, default=0.01)
+    parser.add_argument('--field', type=float, default=0.0, metavar='RESOLUTION',
+                        help='Also time sensing and stepping with a distance field of this resolution')
+    parser.add_argument('--no-paint', action='store_true', help='Skip the Qt paint benchmark')
+    parser.add_argument('--output', default='', help='Write the JSON results to this file (default: stdout)')
+    args = parser.parse_args(argv)
+
+    app = None
+    if not args.no_paint:
+        try:
+            from PyQt5 import QtWidgets
+            if not os.environ.get('DISPLAY'):
+                os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+            app = QtWidgets.QApplication([])
+        except ImportError:
+            print('PyQt5 not available, skipping paint', file=sys.stderr)
+
+    runs = []
+    with tempfile.TemporaryDirectory() as directory:
+        cases = [('maze', s) for s in args.maze_sizes] + [('clutter', s) for s in args.clutter_sizes]
+        for kind, size in cases:
+            path, count = generate(kind, size, directory)
+            run = {'kind': kind, 'size': size, 'obstacles': count}
+            run.update(bench_load(path, args.repeat))
+            run.update(bench_world(path, args.repeat, args.dt))
+            if args.field > 0:
+                run['field'] = bench_world(path, args.repeat, args.dt, args.field)
+            if app:
+                run.update(bench_paint(app, path, args.repeat))
+            runs.append(run)
+            print('{} {}: {} obstacles, sensor {:.1f} us, step {:.1f} us'.format(
+                kind, size, count, run['command_sensor']['median_us'], run['world_advance']['median_us']),
+                file=sys.stderr)
+    report = {'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'python': platform.python_version(),
+              'numpy': np.__version__, 'platform': platform.platform(), 'repeat': args.repeat, 'runs': runs}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,85 @@
+import time
+
+REALTIME = 'realtime'
+SCALED = 'scaled'
+MAX_SPEED = 'max'
+MAX_LAG = 0.1
+
+
+class SimClock:
+    # Simulated time is counted in whole steps of dt, so it depends only on how many steps were taken.
+    # The mode only decides how long wait() holds the caller back in wall time.
+    def __init__(self, dt=0.01, mode=MAX_SPEED, scale=1.0):
+        self.dt = dt
+        self.base = 0.0
+        self.ticks = 0
+        self.mode = mode
+        self.scale = scale
+        self.wall_start = None
+        self.wall_base = 0.0
+
+    @property
+    def time(self):
+        return self.base + self.ticks * self.dt
+
+    @property
+    def speed(self):
+        if self.mode == MAX_SPEED:
+            return 0.0
+        if self.mode == SCALED:
+            return self.scale
+        return 1.0
+
+    def set_dt(self, dt):
+        if dt != self.dt:
+            self.base = self.time
+            self.ticks = 0
+            self.dt = dt
+
+    def set_mode(self, mode, scale=1.0):
+        self.mode = mode
+        self.scale = scale
+        self.rebase()
+
+    def set_speed(self, speed):
+        # 0 runs as fast as possible, 1 in real time, anything else scaled
+        if speed <= 0:
+            self.set_mode(MAX_SPEED)
+        elif speed == 1:
+            self.set_mode(REALTIME)
+        else:
+            self.set_mode(SCALED, speed)
+
+    def tick(self, dt=None):
+        if dt is not None:
+            self.set_dt(dt)
+        self.ticks += 1
+        return self.dt
+
+    def reset(self):
+        self.base = 0.0
+        self.ticks = 0
+        self.rebase()
+
+    def rebase(self):
+        # Forget the wall-clock reference, e.g. after a pause, so the next wait() does not try to catch up
+        self.wall_start = None
+
+    def wait(self, event=None):
+        # Holds the caller until wall time has caught up with simulated time; event.wait is used if given
+        # so a shutdown can interrupt the sleep
+        if self.mode == MAX_SPEED:
+            return
+        now = time.time()
+        if self.wall_start is None:
+            self.wall_start = now
+            self.wall_base = self.time
+        delay = self.wall_start + (self.time - self.wall_base) / self.speed - now
+        if delay > 0:
+            if event:
+                event.wait(delay)
+            else:
+                time.sleep(delay)
+        elif delay < -MAX_LAG:
+            self.wall_start = now
+            self.wall_base = self.time
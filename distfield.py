@@ -0,0 +1,195 @@
+import os
+import math
+import struct
+import numpy as np
+
+# Signed distance to the nearest obstacle, sampled on a square grid of nodes `resolution` apart (negative
+# inside obstacles). Values are clamped to `band`, which only ever understates the distance, so every
+# lookup stays a safe lower bound. The grid covers the obstacles' bounding box grown by band; outside it
+# the distance to that box is used instead.
+# Cached next to the scene as <scene>.sdf: a header recording the scene file's size and mtime and the
+# field parameters, followed by the float32 values row by row.
+MAGIC = b'PRDF'
+VERSION = 1
+HEADER = struct.Struct('<4sIQdddddddII')
+CACHE_SUFFIX = '.sdf'
+BAND_CELLS = 8
+# Values are kept up to at least this distance whatever the resolution: with a narrow band no robot could
+# be shown clear of obstacles and no sensor ray could be skipped in a few steps
+MIN_BAND = 64.0
+MARCH_STEPS = 8
+
+
+def rect_frames(corners):
+    # Centres, unit axes and half sizes of (n, 4, 2) rectangle corners
+    center = 0.5 * (corners[:, 0] + corners[:, 2])
+    u = corners[:, 1] - corners[:, 0]
+    v = corners[:, 3] - corners[:, 0]
+    hw = 0.5 * np.hypot(u[:, 0], u[:, 1])
+    hh = 0.5 * np.hypot(v[:, 0], v[:, 1])
+    return center, u / (2 * hw[:, None]), v / (2 * hh[:, None]), hw, hh
+
+
+def box_distance(x, y, center, u, v, hw, hh):
+    # Signed distance from points x, y to one rectangle (broadcasting)
+    dx = x - center[0]
+    dy = y - center[1]
+    qx = np.abs(dx * u[0] + dy * u[1]) - hw
+    qy = np.abs(dx * v[0] + dy * v[1]) - hh
+    return np.hypot(np.maximum(qx, 0), np.maximum(qy, 0)) + np.minimum(np.maximum(qx, qy), 0)
+
+
+def rect_distance(points, corners):
+    # Exact signed distance from (m, 2) points to the union of (n, 4, 2) rectangles, O(m * n)
+    result = np.full(len(points), np.inf)
+    if len(corners) == 0:
+        return result
+    frames = rect_frames(corners)
+    for k in range(len(corners)):
+        d = box_distance(points[:, 0], points[:, 1], *[f[k] for f in frames])
+        np.minimum(result, d, out=result)
+    return result
+
+
+def build_values(corners, resolution, band, lo, hi):
+    nx = int(math.ceil((hi[0] - lo[0] + 2 * band) / resolution)) + 1
+    ny = int(math.ceil((hi[1] - lo[1] + 2 * band) / resolution)) + 1
+    origin = lo - band
+    values = np.full((ny, nx), band, dtype=np.float32)
+    frames = rect_frames(corners)
+    clo = corners.min(axis=1) - band
+    chi = corners.max(axis=1) + band
+    # Each rectangle only lowers the nodes within band of its bounding box
+    i0 = np.clip(np.floor((clo - origin) / resolution).astype(int), 0, None)
+    i1 = np.minimum(np.ceil((chi - origin) / resolution).astype(int), (nx - 1, ny - 1))
+    for k in range(len(corners)):
+        x = origin[0] + resolution * np.arange(i0[k, 0], i1[k, 0] + 1)
+        y = origin[1] + resolution * np.arange(i0[k, 1], i1[k, 1] + 1)
+        d = box_distance(x[None, :], y[:, None], *[f[k] for f in frames])
+        window = values[i0[k, 1]:i1[k, 1] + 1, i0[k, 0]:i1[k, 0] + 1]
+        np.minimum(window, d, out=window, casting='unsafe')
+    return values
+
+
+class DistanceField:
+    def __init__(self, values, resolution, band, lo, hi):
+        self.values = np.asarray(values)
+        self.resolution = resolution
+        self.band = band
+        self.lo = np.asarray(lo, dtype=float)
+        self.hi = np.asarray(hi, dtype=float)
+        self.origin = self.lo - band
+        self.limit = np.array((values.shape[1] - 1, values.shape[0] - 1))
+        # float32 rounding, kept out of the lower bound
+        self.slack = 1e-5 * max(band, 1.0)
+        self.margin = math.sqrt(0.5) * resolution + self.slack
+        # Plain floats for march, where numpy scalar arithmetic would dominate
+        self.bounds = tuple(self.origin.tolist() + self.lo.tolist() + self.hi.tolist() + self.limit.tolist())
+
+    def outside_distance(self, points):
+        d = np.maximum(np.maximum(self.lo - points, points - self.hi), 0)
+        return np.hypot(d[:, 0], d[:, 1])
+
+    def safe_distance(self, points):
+        # Lower bound on the distance from (m, 2) points to any obstacle: the value at the nearest node less
+        # half a cell diagonal, as a distance field changes no faster than the point moves. Points beyond the
+        # grid are at least band away, which no node value exceeds, so clamping them to the edge is safe too.
+        index = np.clip(np.rint((points - self.origin) / self.resolution).astype(int), 0, self.limit)
+        return self.values[index[:, 1], index[:, 0]] - self.margin
+
+    def safe_distance_at(self, x, y):
+        # Tighter lower bound for one point on plain floats: the nearest node's value less the exact distance
+        # to that node, or the distance to the covered box if that is larger
+        ox, oy, x0, y0, x1, y1, nx, ny = self.bounds
+        res = self.resolution
+        i = min(max(int((x - ox) / res + 0.5), 0), nx)
+        j = min(max(int((y - oy) / res + 0.5), 0), ny)
+        d = self.values.item(j, i) - math.hypot(x - ox - i * res, y - oy - j * res) - self.slack
+        if x < x0 or x > x1 or y < y0 or y > y1:
+            d = max(d, math.hypot(max(x0 - x, x - x1, 0.0), max(y0 - y, y - y1, 0.0)))
+        return d
+
+    def sample(self, points):
+        # Bilinear estimate of the signed distance at (m, 2) points, within about a resolution of the truth
+        g = np.clip((points - self.origin) / self.resolution, 0, self.limit)
+        i = np.minimum(np.floor(g).astype(int), np.maximum(self.limit - 1, 0))
+        f = g - i
+        j = np.minimum(i + 1, self.limit)
+        v = self.values
+        top = v[i[:, 1], i[:, 0]] * (1 - f[:, 0]) + v[i[:, 1], j[:, 0]] * f[:, 0]
+        bottom = v[j[:, 1], i[:, 0]] * (1 - f[:, 0]) + v[j[:, 1], j[:, 0]] * f[:, 0]
+        return np.maximum(top * (1 - f[:, 1]) + bottom * f[:, 1], self.outside_distance(points))
+
+    def march(self, x, y, dx, dy, length):
+        # Sphere tracing along one ray: the distance it can travel from (x, y) before it comes within a
+        # resolution of an obstacle, or length if it never does. Rays grazing a wall advance slowly, so after
+        # MARCH_STEPS steps the caller takes over with exact geometry from wherever the ray got to.
+        res = self.resolution
+        t = 0.0
+        for k in range(MARCH_STEPS):
+            d = self.safe_distance_at(x + t * dx, y + t * dy)
+            if d < res:
+                break
+            t += d
+            if t >= length:
+                return length
+        return t
+
+
+def default_band(resolution):
+    return max(BAND_CELLS * resolution, MIN_BAND)
+
+
+def build_field(corners, resolution, band=0.0):
+    if len(corners) == 0:
+        return None
+    band = band or default_band(resolution)
+    corners = np.asarray(corners, dtype=float)
+    lo = corners.reshape(-1, 2).min(axis=0)
+    hi = corners.reshape(-1, 2).max(axis=0)
+    return DistanceField(build_values(corners, resolution, band, lo, hi), resolution, band, lo, hi)
+
+
+def save_field(field, cache_path, path):
+    st = os.stat(path)
+    ny, nx = field.values.shape
+    tmp_path = '{}.{}.tmp'.format(cache_path, os.getpid())
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, st.st_size, st.st_mtime, field.resolution, field.band,
+                            field.lo[0], field.lo[1], field.hi[0], field.hi[1], nx, ny))
+        f.write(np.ascontiguousarray(field.values, dtype='<f4').tobytes())
+    os.replace(tmp_path, cache_path)
+
+
+def map_field(cache_path, path, resolution, band):
+    # The cached field, or None if it is missing, corrupt, older than path or built with other parameters
+    try:
+        with open(cache_path, 'rb') as f:
+            header = f.read(HEADER.size)
+        magic, version, size, mtime, res, b, x0, y0, x1, y1, nx, ny = HEADER.unpack(header)
+    except (IOError, struct.error):
+        return None
+    st = os.stat(path)
+    if magic != MAGIC or version != VERSION or st.st_size != size or st.st_mtime != mtime:
+        return None
+    if res != resolution or b != band or os.path.getsize(cache_path) != HEADER.size + 4 * nx * ny:
+        return None
+    values = np.memmap(cache_path, dtype='<f4', mode='r', offset=HEADER.size, shape=(ny, nx))
+    return DistanceField(values, res, b, (x0, y0), (x1, y1))
+
+
+def load_field(path, corners, resolution, band=0.0):
+    # Field for a scene's obstacle corners, read from <path>.sdf when current and built (and cached) otherwise
+    band = band or default_band(resolution)
+    if not path or len(corners) == 0:
+        return build_field(corners, resolution, band)
+    cache_path = path + CACHE_SUFFIX
+    field = map_field(cache_path, path, resolution, band)
+    if field is not None:
+        return field
+    field = build_field(corners, resolution, band)
+    try:
+        save_field(field, cache_path, path)
+    except (IOError, OSError):
+        pass
+    return field
@@ -1,65 +1,91 @@
-from PyQt5 import QtGui
-from vtypes import vec2
+import numpy as np
 
 
-def norm(p):
-    return vec2(p.x(), p.y()).norm()
+class Edges:
+    # One row per polygon side: p1.x p1.y p2.x p2.y N.x N.y d, where N is the unit normal and d = p1 * N
+    def __init__(self, table):
+        self.table = table
+        self.p1 = table[:, 0:2]
+        self.p2 = table[:, 2:4]
+        self.N = table[:, 4:6]
+        self.d = table[:, 6]
 
+    def __len__(self):
+        return self.table.shape[0]
 
-class Segment:
-    def __init__(self, *args):
-        if isinstance(args[0], QtGui.QPolygonF):
-            poly = args[0]
-            i = args[1]
-            self.p1 = vec2(poly.at(i))
-            self.p2 = vec2(poly.at((i + 1) % poly.size()))
-        if isinstance(args[0], vec2):
-            self.p1 = args[0]
-            self.p2 = args[1]
-        D = self.p2 - self.p1;
-        self.N = vec2(-D.y, D.x).normalized()
-        self.d = self.p1 * self.N
 
+def build_edge_table(polys):
+    # polys is an (n, k, 2) array of n polygons with k corners each; returns the (n * k, 7) edge table
+    table = np.empty((polys.shape[0] * polys.shape[1], 7))
+    table[:, 0:2] = polys.reshape(-1, 2)
+    table[:, 2:4] = np.concatenate((polys[:, 1:], polys[:, :1]), axis=1).reshape(-1, 2)
+    D = table[:, 2:4] - table[:, 0:2]
+    length = np.hypot(D[:, 0], D[:, 1])
+    table[:, 4] = -D[:, 1] / length
+    table[:, 5] = D[:, 0] / length
+    table[:, 6] = np.einsum('ij,ij->i', table[:, 0:2], table[:, 4:6])
+    return table
 
-def check_segment_intersection(s1, s2):
-    return (s1.p1 * s2.N - s2.d) * (s1.p2 * s2.N - s2.d) < 0 and (s2.p1 * s1.N - s1.d) * (s2.p2 * s1.N - s1.d) < 0
 
+def facing_edges(edges, point, margin):
+    # Polygons are wound so that N points inwards. A ray starting outside a polygon first hits
+    # a side whose outer half-plane contains the start, so sides seen from the inside can be skipped.
+    keep = edges.N @ (point.x, point.y) - edges.d < margin
+    return Edges(edges.table[keep])
 
-def check_poly_intersection(p1, p2):
-    s1 = [Segment(p1, i) for i in range(p1.size())]
-    s2 = [Segment(p2, i) for i in range(p2.size())]
-    for si in s1:
-        for sj in s2:
-            if check_segment_intersection(si, sj):
-                return True
-    return False
 
+def aabb(table):
+    # Bounding boxes of edge tables shaped (..., k, 7): returns the (..., 2) lower and upper corners
+    return table[..., 0:2].min(axis=-2), table[..., 0:2].max(axis=-2)
 
-def check_intersection(o1, o2):
-    dist = norm(o1.pos - o2.pos)
-    sum_rad = o1.radius + o2.radius
-    if dist > sum_rad:
-        return False
-    return check_poly_intersection(o1.poly, o2.poly)
 
+def sat_pairs(t1, t2):
+    # Separating-axis test for convex polygons, one pair of edge tables per row: t1 is (P, k, 7), t2 is (P, l, 7).
+    # Both polygons are projected on every side normal of either; the smallest interval overlap is the
+    # penetration depth, positive when they intersect (including one inside the other), <= 0 when apart.
+    axes = np.concatenate((t1[:, :, 4:6], t2[:, :, 4:6]), axis=1)
+    p1 = np.einsum('pac,pvc->pav', axes, t1[:, :, 0:2])
+    p2 = np.einsum('pac,pvc->pav', axes, t2[:, :, 0:2])
+    overlap = np.minimum(p1.max(axis=2) - p2.min(axis=2), p2.max(axis=2) - p1.min(axis=2))
+    return overlap.min(axis=1)
 
-def intersection_distance(ray_seg, seg):
-    p = ray_seg.p1
-    r = ray_seg.p2 - ray_seg.p1
-    q = seg.p1
-    s = seg.p2 - seg.p1
-    t = (q - p).cross(s / r.cross(s))
-    return t
 
+def ray_intersection(start, dir, length, edges):
+    p = np.array((start.x, start.y))
+    r = np.array((dir.x, dir.y)) * length
+    n = np.array((-dir.y, dir.x))
+    d = p @ n
+    a = edges.p1 @ n - d
+    b = edges.p2 @ n - d
+    u = edges.N @ p - edges.d
+    v = edges.N @ (p + r) - edges.d
+    hit = (a * b < 0) & (u * v < 0)
+    if not hit.any():
+        return -0.01 * length
+    q = edges.p1[hit]
+    s = edges.p2[hit] - q
+    qp = q - p
+    t = (qp[:, 0] * s[:, 1] - qp[:, 1] * s[:, 0]) / (r[0] * s[:, 1] - r[1] * s[:, 0])
+    return t.min() * length
 
-def ray_intersection(start, dir, length, obj):
-    s = Segment(start, start + dir * length)
-    poly = obj.poly
-    sp = [Segment(poly, i) for i in range(poly.size())]
-    min_t = -0.01
-    for side in sp:
-        if check_segment_intersection(s, side):
-            t = intersection_distance(s, side)
-            if t < min_t or min_t < 0:
-                min_t = t
-    return min_t * length
+
+def ray_intersections(starts, dirs, length, edges):
+    # Batch version of ray_intersection: starts and dirs are (m, 2) arrays, all rays against all edges at once
+    m = starts.shape[0]
+    if len(edges) == 0 or m == 0:
+        return np.full(m, -0.01 * length)
+    r = dirs * length
+    n = np.stack((-dirs[:, 1], dirs[:, 0]), axis=1)
+    d = np.einsum('ij,ij->i', starts, n)
+    a = edges.p1 @ n.T - d
+    b = edges.p2 @ n.T - d
+    u = starts @ edges.N.T - edges.d
+    v = (starts + r) @ edges.N.T - edges.d
+    hit = ((a * b).T < 0) & (u * v < 0)
+    s = edges.p2 - edges.p1
+    qx = edges.p1[:, 0] - starts[:, 0:1]
+    qy = edges.p1[:, 1] - starts[:, 1:2]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = (qx * s[:, 1] - qy * s[:, 0]) / (r[:, 0:1] * s[:, 1] - r[:, 1:2] * s[:, 0])
+    t = np.where(hit, t, np.inf).min(axis=1)
+    return np.where(np.isfinite(t), t * length, -0.01 * length)
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+import sys
+import os
+import time
+import argparse
+import threading
+import importlib
+import importlib.util
+from world import World, read_path_from_file
+import rclient
+import protocol
+import stats
+from recorder import Recorder
+
+
+def load_controller(name, fresh=False):
+    # name is a module name or a path to a .py file; fresh re-executes it so module state starts clean
+    if not name or name == 'none':
+        return None
+    if name.endswith('.py'):
+        module_name = os.path.splitext(os.path.basename(name))[0]
+        spec = importlib.util.spec_from_file_location(module_name, name)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        return module
+    if fresh and name in sys.modules:
+        return importlib.reload(sys.modules[name])
+    return importlib.import_module(name)
+
+
+class LockedWorld:
+    # Command entry points for server threads, taken under the same lock that run() holds for each step
+    def __init__(self, world):
+        self.world = world
+        self.lock = threading.RLock()
+
+    def process_command(self, cmd, args, robot=0):
+        with self.lock:
+            return self.world.process_command(cmd, args, robot)
+
+    def execute(self, cmd, args, robot=0):
+        with self.lock:
+            return self.world.execute(cmd, args, robot)
+
+
+def run(world, controller, duration, dt, lock=None):
+    # lock, if given, is held for each controller call and step, so commands from server threads never
+    # see the world in the middle of one
+    lock = lock or threading.RLock()
+    steps = 0
+    while world.time < duration:
+        with lock:
+            if controller:
+                t = stats.clock()
+                controller.run()
+                stats.record('controller', stats.clock() - t)
+            if not world.advance(dt):
+                break
+        world.clock.wait()
+        steps += 1
+    return steps
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run a scene without the Qt front end')
+    parser.add_argument('scene', nargs='?', default='', help='Scene file (defaults to cur.cfg)')
+    parser.add_argument('--controller', default='simrobot', help="Controller module with a run() function, or 'none'")
+    parser.add_argument('--duration', type=float, default=60.0, help='Simulated seconds to run')
+    parser.add_argument('--dt', type=float, default=0.01, help='Simulation step in seconds')
+    parser.add_argument('--speed', type=float, default=0.0,
+                        help='Simulated seconds per wall second; 0 runs as fast as possible')
+    parser.add_argument('--stats', type=float, default=0.0, metavar='SECONDS',
+                        help='Print per-phase timings every SECONDS of wall time and at the end')
+    parser.add_argument('--record', default='', metavar='LOG', help='Record the trajectory to this log')
+    parser.add_argument('--field', type=float, default=0.0, metavar='RESOLUTION',
+                        help='Sense and check clearance through a signed distance field with this node spacing')
+    parser.add_argument('--serve', action='store_true', help='Accept UDP commands while running')
+    parser.add_argument('--port', type=int, default=protocol.PORT, help='UDP port to serve on; 0 picks a free one')
+    parser.add_argument('--shm', default='', metavar='NAME',
+                        help='Also serve commands and telemetry through the shared-memory segment NAME')
+    args = parser.parse_args(argv)
+
+    scene_path = args.scene
+    if not scene_path and os.path.exists('cur.cfg'):
+        scene_path = read_path_from_file('cur.cfg')
+
+    world = World()
+    world.clock.set_dt(args.dt)
+    world.clock.set_speed(args.speed)
+    world.set_field_resolution(args.field)
+    if scene_path:
+        world.load_scene(scene_path)
+    rclient.simhook = world.robots
+    locked = LockedWorld(world)
+    api = None
+    if args.serve:
+        import server
+        api = server.API(locked.process_command, locked.execute, port=args.port, robots=lambda: len(world.robots))
+        print('Serving on port {}'.format(api.port), file=sys.stderr)
+    shm_api = None
+    if args.shm:
+        import server
+        shm_api = server.SharedMemoryAPI(locked.execute, args.shm)
+        world.telemetry = shm_api
+    controller = load_controller(args.controller)
+    if args.record:
+        world.recorder = Recorder(world, args.record, scene_path)
+    dumper = stats.start_dump(args.stats) if args.stats > 0 else None
+    start = time.time()
+    steps = run(world, controller, args.duration, args.dt, locked.lock)
+    elapsed = time.time() - start
+    if dumper:
+        dumper.stop()
+        dumper.dump()
+    if world.recorder:
+        world.recorder.close()
+    if api:
+        api.shutdown()
+    if shm_api:
+        shm_api.shutdown()
+    pos = world.robot.pos
+    crashed = int(world.collided.sum())
+    print('{}: {} steps, {:.2f} sim s in {:.3f} wall s, pose ({:.1f}, {:.1f}, {:.1f}){}'.format(
+        scene_path or '<default>', steps, world.time, elapsed, pos.x, pos.y, world.robot.angle,
+        ', {}/{} CRASHED'.format(crashed, len(world.robots)) if crashed else ''))
+    return 1 if world.over else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
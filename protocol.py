@@ -0,0 +1,39 @@
+import struct
+
+# Binary datagrams: a header followed by `count` records. Each record carries a request id, the
+# robot it addresses, an opcode and `n` float64 values (command arguments, or reply values).
+# Text commands always start with a printable character, so MAGIC can never begin one.
+MAGIC = 0xB5
+VERSION = 1
+PORT = 9080
+HEADER = struct.Struct('<BBH')
+RECORD = struct.Struct('<IHBH')
+OPCODES = ['', 'V', 'SA', 'S', 'E', 'RESET', 'SCAN', 'SCANA', 'T', 'SNAP', 'RESTORE', 'DROP', 'HELLO', 'BYE']
+OPCODE = dict((name, i) for i, name in enumerate(OPCODES) if name)
+
+
+def is_binary(data):
+    return len(data) >= HEADER.size and data[0] == MAGIC
+
+
+def pack(records):
+    parts = [HEADER.pack(MAGIC, VERSION, len(records))]
+    for request_id, robot, opcode, values in records:
+        parts.append(RECORD.pack(request_id, robot, opcode, len(values)))
+        parts.append(struct.pack('<{}d'.format(len(values)), *values))
+    return b''.join(parts)
+
+
+def unpack(data):
+    magic, version, count = HEADER.unpack_from(data, 0)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError('Unsupported packet version {}'.format(version))
+    offset = HEADER.size
+    records = []
+    for i in range(count):
+        request_id, robot, opcode, n = RECORD.unpack_from(data, offset)
+        offset += RECORD.size
+        values = struct.unpack_from('<{}d'.format(n), data, offset)
+        offset += 8 * n
+        records.append((request_id, robot, opcode, values))
+    return records
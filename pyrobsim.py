@@ -1,329 +1,338 @@
 #!/usr/bin/env python3
 import sys
 import os
-import math
 import time
+import threading
+from collections import OrderedDict
 from PyQt5 import QtCore, QtGui, QtWidgets
-from vtypes import matrix, pt, vec2
-from geometry import check_intersection, ray_intersection
+from world import World, read_path_from_file
 import server
+import protocol
 import rclient
+import stats
+from recorder import Recorder, Replay
 
 draw_circles = False
+TILE_SIZE = 500
+TILE_CACHE_SIZE = 64
+SIM_DT = 0.01
+SIM_SPEED = 1.0
+IDLE_WAIT = 0.05
+MAX_FPS = 60.0
 start = time.time()
-RAD2DEG = 180.0 / 3.14159265358979
-START_POS = pt(150, 150)
-
-
-def parse_line(line):
-    p = line.strip().split()
-    try:
-        p = [float(v) for v in p]
-        return p
-    except ValueError:
-        return None
-
-
-class Object:
-    def __init__(self):
-        self.poly = QtGui.QPolygonF()
-        self.pos = QtCore.QPointF(0, 0)
-        self.radius = 0.0
-
-    def build_rect_poly(self, w, h):
-        self.poly.append(0.5 * pt(-w, -h))
-        self.poly.append(0.5 * pt(w, -h))
-        self.poly.append(0.5 * pt(w, h))
-        self.poly.append(0.5 * pt(-w, h))
-        self.radius = vec2(0.5 * w, 0.5 * h).norm()
-
-    def draw(self, qp):
-        if draw_circles:
-            qp.setPen(QtGui.QPen(QtGui.QColor(255, 0, 0)))
-            qp.setBrush(QtCore.Qt.NoBrush)
-            qp.drawEllipse(self.pos, self.radius, self.radius)
-
-
-class Obstacle(Object):
-    def __init__(self, x, y, w, h, angle):
-        super(Obstacle, self).__init__()
-        self.build_rect_poly(w, h)
-        self.pos = pt(x, y)
-        mat = matrix(angle)
-        self.poly = mat.map(self.poly)
-        self.poly.translate(self.pos)
-
-    def draw(self, qp, offset):
-        color = QtGui.QColor(0, 0, 255)
-        qp.setBrush(QtGui.QBrush(color))
-        qp.setPen(color)
-        poly=QtGui.QPolygonF(self.poly)
-        poly.translate(-offset)
-        qp.drawPolygon(poly)
-        super(Obstacle, self).draw(qp)
-
-
-class Robot(Object):
-    def __init__(self):
-        super(Robot, self).__init__()
-        self.obstacles = []
-        self.orig_pic = QtGui.QImage('robot.png')
-        self.build_rect_poly(self.orig_pic.width(), self.orig_pic.height())
-        self.orig_poly = self.poly
-        self.start_pose = (150, 150, 0)
-        self.pos = pt(0, 0)
-        self.width = self.orig_pic.width()
-        self.angle = 0
-        self.restart()
-        self.sensor_angle = 0
-        self.mat = matrix(self.angle)
-        self.velocity = vec2(0.0, 0.0)
-        self.encoders = vec2(0.0, 0.0)
-        self.encoder_clicks = (0, 0)
-        self.pic = self.orig_pic.transformed(QtGui.QTransform())
-        self.servo_pos = pt(0, -20)
-        self.api = server.API(self.process_command)
-        self.commands = {'V': self.command_velocity, 'SA': self.command_sensor_angle, 'S': self.command_sensor,
-                         'E': self.command_encoders, 'RESET': self.command_reset}
 
-    def restart(self):
-        self.set_pos(self.start_pose[0], self.start_pose[1])
-        self.set_angle(self.start_pose[2])
-        self.set_sensor_angle(0.0)
-        self.velocity = vec2(0.0, 0.0)
-        self.encoders = vec2(0.0, 0.0)
-        self.encoder_clicks = (0, 0)
 
-    def shutdown(self):
-        self.api.shutdown()
+def matrix(angle):
+    mat = QtGui.QTransform()
+    mat.rotate(angle)
+    return mat
 
-    def process_command(self, cmd, args):
-        if not cmd in self.commands:
-            return ''
-        handler = self.commands.get(cmd)
-        return handler(args)
-
-    def command_reset(self, args):
-        self.restart()
-
-    def command_velocity(self, args):
-        if len(args) == 2:
-            if abs(args[0])<=250 and abs(args[1])<=250:
-                self.velocity = vec2(args[0], args[1])
-        return ''
-
-    def command_sensor_angle(self, args):
-        if len(args) == 1:
-            self.set_sensor_angle(args[0])
-        return ''
-
-    def command_sensor(self, args):
-        position = self.get_sensor_position()
-        direction = self.get_sensor_direction()
-        minimum_distance = -1
-        for o in self.obstacles:
-            distance = ray_intersection(position, direction, 200.0, o)
-            if distance >= 0 or minimum_distance < 0:
-                minimum_distance = distance
-        return 'S {}'.format(minimum_distance)
-
-    def command_encoders(self, args):
-        result = 'E {} {}'.format(*self.encoder_clicks)
-        self.encoder_clicks = (0, 0)
-        return result
-
-    def set_sensor_angle(self, a):
-        if 45 >= a >= -45:
-            self.sensor_angle = a
-
-    def get_sensor_position(self):
-        mat = matrix(self.sensor_angle)
-        p = mat.map(pt(0, -5)) + self.servo_pos
-        mat = matrix(self.angle)
-        p = mat.map(p) + self.pos
-        return vec2(p)
-
-    def get_sensor_direction(self):
-        mat = matrix(self.sensor_angle)
-        mat.rotate(self.angle)
-        return vec2(mat.map(pt(0, -1)))
-
-    def set_angle(self, a):
-        self.angle = a
-        self.mat = matrix(self.angle)
-
-    def rotate(self, da):
-        self.angle += da
-        self.mat.rotate(da)
-
-    def set_pos(self, *args):
-        if len(args) == 2:
-            self.pos = pt(args[0], args[1])
-        elif len(args) == 1:
-            a = args[0]
-            if isinstance(a, vec2):
-                self.pos = pt(a.x, a.y)
-            else:
-                self.pos = a
 
-    def set_start_pose(self, x, y, a):
-        self.start_pose = (x, y, a)
-        self.restart()
+def pt(x, y):
+    return QtCore.QPointF(x, y)
 
-    def pic_center(self):
-        return 0.5 * pt(self.pic.width(), self.pic.height())
 
-    def set_obstacles(self, obs):
-        self.obstacles = obs
+def qpt(v):
+    return QtCore.QPointF(v.x, v.y)
+
+
+def qpoly(poly):
+    return QtGui.QPolygonF([qpt(p) for p in poly])
+
+
+def draw_circle(qp, pos, radius, offset):
+    if draw_circles:
+        qp.setPen(QtGui.QPen(QtGui.QColor(255, 0, 0)))
+        qp.setBrush(QtCore.Qt.NoBrush)
+        qp.drawEllipse(pos - offset, radius, radius)
 
-    def update_image(self):
-        self.pic = self.orig_pic.transformed(self.mat, QtCore.Qt.SmoothTransformation)
-        self.poly = self.mat.map(self.orig_poly)
-        self.poly.translate(self.pos)
-        qp = QtGui.QPainter()
-        qp.begin(self.pic)
-        self.draw_sensor(qp, self.pic_center())
-        qp.end()
 
-    def draw_sensor(self, qp, pos):
-        servo_mat = matrix(self.sensor_angle)
-        p1 = servo_mat.map(pt(-5, -5)) + self.servo_pos
-        p2 = servo_mat.map(pt(5, -5)) + self.servo_pos
-        p1 = self.mat.map(p1)
-        p2 = self.mat.map(p2)
+def draw_obstacle(qp, obstacle, offset):
+    color = QtGui.QColor(0, 0, 255)
+    qp.setBrush(QtGui.QBrush(color))
+    qp.setPen(color)
+    poly = qpoly(obstacle.poly)
+    poly.translate(-offset)
+    qp.drawPolygon(poly)
+    draw_circle(qp, qpt(obstacle.pos), obstacle.radius, offset)
+
+
+class SpriteCache:
+    # Robot image pre-rotated at angles quantized to 'step' degrees, least recently used dropped first.
+    # By default there is room for every angle: a robot turning in circles visits them in order, and any
+    # smaller LRU would evict each one just before it came round again.
+    def __init__(self, path, step=1.0, capacity=0):
+        self.orig_pic = QtGui.QImage(path)
+        self.step = step
+        self.angles = int(round(360.0 / step))
+        self.capacity = capacity or self.angles
+        self.images = OrderedDict()
+
+    def get(self, angle):
+        key = int(round(angle / self.step)) % self.angles
+        if key in self.images:
+            self.images.move_to_end(key)
+            return self.images[key]
+        pic = self.orig_pic.transformed(matrix(key * self.step), QtCore.Qt.SmoothTransformation)
+        entry = (pic, 0.5 * pt(pic.width(), pic.height()))
+        self.images[key] = entry
+        if len(self.images) > self.capacity:
+            self.images.popitem(last=False)
+        return entry
+
+
+class RobotSprite:
+    def __init__(self, robot, cache):
+        self.robot = robot
+        self.cache = cache
+
+    def draw_sensor(self, qp, pos, angle, sensor_angle):
+        mat = matrix(angle)
+        servo_mat = matrix(sensor_angle)
+        servo_pos = qpt(self.robot.servo_pos)
+        p1 = mat.map(servo_mat.map(pt(-5, -5)) + servo_pos)
+        p2 = mat.map(servo_mat.map(pt(5, -5)) + servo_pos)
         qp.setPen(QtGui.QPen(QtGui.QBrush(QtGui.QColor(0, 0, 255)), 2))
         qp.drawLine(pos + p1, pos + p2)
 
-    def draw(self, qp, offset):
-        self.update_image()
-        draw_pos = self.pos - self.pic_center() - offset
-        qp.drawImage(draw_pos, self.pic)
-        super(Robot, self).draw(qp)
-
-    def advance(self, full_dt):
-        start = (math.floor(self.encoders[0]), math.floor(self.encoders[1]))
-        while full_dt > 0:
-            dt = min(0.001, full_dt)
-            full_dt -= dt
-            pl = dt * self.velocity[0]
-            pr = dt * self.velocity[1]
-            da = math.atan2(pr - pl, self.width)
-            dp = 0.5 * (pl + pr)
-            self.set_pos(self.pos + dp * self.mat.map(pt(0, -1)))
-            self.rotate(-da * RAD2DEG)
-            self.encoders += vec2(pl, pr)
-        stop = (math.floor(self.encoders[0]), math.floor(self.encoders[1]))
-        self.encoder_clicks = (self.encoder_clicks[0] + int(stop[0] - start[0]),
-                               self.encoder_clicks[1] + int(stop[1] - start[1]))
+    def draw(self, qp, offset, pose, sensor_angle):
+        # pose and sensor_angle come from the render snapshot, not the live world
+        pic, center = self.cache.get(pose[2])
+        pos = pt(pose[0], pose[1]) - offset
+        qp.drawImage(pos - center, pic)
+        self.draw_sensor(qp, pos, pose[2], sensor_angle)
+        draw_circle(qp, pos, self.robot.radius, pt(0, 0))
+
+
+class SimulationThread(threading.Thread):
+    # Steps the sandbox by the clock's fixed dt, paced by the clock mode, whatever the paint load
+    def __init__(self, sandbox, clock):
+        super(SimulationThread, self).__init__()
+        self.daemon = True
+        self.sandbox = sandbox
+        self.clock = clock
+        self.controller = None
+        self.paused = False
+        self.done = False
+        self.wake = threading.Event()
+
+    def run(self):
+        while not self.done:
+            if not self.paused and self.sandbox.step(self.controller):
+                self.clock.wait(self.wake)
+            else:
+                # Nothing to simulate while paused or after a crash; idle without accumulating lag
+                self.clock.rebase()
+                self.wake.wait(IDLE_WAIT)
+
+    def stop(self):
+        self.done = True
+        self.wake.set()
+        if self.is_alive():
+            self.join()
 
 
 class SandboxWidget(QtWidgets.QWidget):
-    def __init__(self, parent=None):
+    def __init__(self, port=protocol.PORT, shm='', parent=None):
         super(SandboxWidget, self).__init__(parent, QtCore.Qt.WindowFlags())
-        self.over = False
         self.setMinimumSize(800, 600)
-        self.obstacles = [Obstacle(300, 100, 150, 30, 20)]
-        self.lines = []
-        self.robot = Robot()
-        rclient.simhook[0] = self.robot
-        self.robot.set_obstacles(self.obstacles)
+        self.world = World()
+        self.robot = self.world.robot
+        self.sprites = []
+        self.sprite_cache = SpriteCache('robot.png')
+        self.tiles = OrderedDict()
+        # The simulation thread, the API thread and painting all share the world through this lock
+        self.lock = threading.RLock()
+        self.snapshot = self.take_snapshot()
+        rclient.simhook = self.world.robots
+        self.api = server.API(self.process_command, self.execute, port=port, robots=lambda: len(self.world.robots))
+        if not self.api.done:
+            print('Serving on port {}'.format(self.api.port), file=sys.stderr)
+        self.shm_api = None
+        if shm:
+            self.shm_api = server.SharedMemoryAPI(self.execute, shm)
+            self.world.telemetry = self.shm_api
         self.offset = pt(0.0,0.0)
+        self.record_path = ''
+
+    @property
+    def over(self):
+        return self.snapshot[2]
+
+    def take_snapshot(self):
+        return self.world.pose.copy(), self.world.sensor_angle.copy(), self.world.over
+
+    def process_command(self, cmd, args, robot=0):
+        with self.lock:
+            return self.world.process_command(cmd, args, robot)
+
+    def execute(self, cmd, args, robot=0):
+        with self.lock:
+            return self.world.execute(cmd, args, robot)
+
+    def step(self, controller):
+        with self.lock:
+            if self.world.over:
+                return False
+            if controller:
+                t = stats.clock()
+                controller.run()
+                stats.record('controller', stats.clock() - t)
+            self.world.advance()
+            self.snapshot = self.take_snapshot()
+            return True
 
     def restart(self):
-        self.over = False
-        self.robot.restart()
+        with self.lock:
+            self.world.restart()
+            self.snapshot = self.take_snapshot()
 
     def load_scene(self, path):
-        del self.obstacles[:]
         try:
-            with open(path, 'r') as f:
-                for line in f.readlines():
-                    p = parse_line(line)
-                    if len(p) == 5:
-                        self.obstacles.append(Obstacle(*p))
-                    if len(p) == 4:
-                        self.lines.append(tuple(p))
-                    if len(p) == 3:
-                        self.robot.set_start_pose(*p)
+            with self.lock:
+                self.world.load_scene(path)
+                self.tiles.clear()
+                if self.record_path:
+                    # Every loaded scene starts a fresh log, as the robot count may have changed
+                    self.stop_recording()
+                    self.world.recorder = Recorder(self.world, self.record_path, path)
+                self.snapshot = self.take_snapshot()
         except IOError:
-            QtWidgets.QMessageBox(None, "Error", "{} not found".format(path))
-
-    def draw_grid(self, qp):
+            QtWidgets.QMessageBox.critical(None, "Error", "{} not found".format(path))
+
+    def stop_recording(self):
+        with self.lock:
+            if self.world.recorder:
+                self.world.recorder.close()
+                self.world.recorder = None
+
+    def show_replay(self, replay, tick):
+        with self.lock:
+            while len(self.world.robots) < replay.count:
+                self.world.add_robot(0, 0, 0)
+            replay.apply(self.world, tick)
+            self.snapshot = self.take_snapshot()
+
+    def render_tile(self, i, j, index, obstacles, lines):
+        # Grid, guide lines and obstacles of one TILE_SIZE square of the world, on a transparent background
+        x0 = i * TILE_SIZE
+        y0 = j * TILE_SIZE
+        tile = QtGui.QImage(TILE_SIZE, TILE_SIZE, QtGui.QImage.Format_ARGB32_Premultiplied)
+        tile.fill(QtCore.Qt.transparent)
+        origin = pt(x0, y0)
+        qp = QtGui.QPainter()
+        qp.begin(tile)
+        step = 20
+        p1 = QtGui.QPen(QtGui.QBrush(QtGui.QColor(128, 128, 128)), 1)
+        p2 = QtGui.QPen(QtGui.QBrush(QtGui.QColor(0, 0, 0)), 2)
+        for v in range(0, TILE_SIZE + step, step):
+            qp.setPen(p2 if ((y0 + v) % 100) < step else p1)
+            qp.drawLine(QtCore.QLineF(0, v, TILE_SIZE, v))
+            qp.setPen(p2 if ((x0 + v) % 100) < step else p1)
+            qp.drawLine(QtCore.QLineF(v, 0, v, TILE_SIZE))
+        x1 = x0 + TILE_SIZE
+        y1 = y0 + TILE_SIZE
+        qp.setPen(QtGui.QPen(QtGui.QBrush(QtGui.QColor(255, 96, 32)), 3))
+        for line in lines:
+            if min(line[0], line[2]) <= x1 and max(line[0], line[2]) >= x0 and \
+               min(line[1], line[3]) <= y1 and max(line[1], line[3]) >= y0:
+                qp.drawLine(pt(line[0], line[1]) - origin, pt(line[2], line[3]) - origin)
+        for k in index.query(x0, y0, x1, y1).tolist():
+            draw_obstacle(qp, obstacles[k], origin)
+        qp.end()
+        return tile
+
+    def get_tile(self, i, j, index, obstacles, lines):
+        key = (i, j)
+        if key in self.tiles:
+            self.tiles.move_to_end(key)
+            return self.tiles[key]
+        tile = self.render_tile(i, j, index, obstacles, lines)
+        self.tiles[key] = tile
+        if len(self.tiles) > TILE_CACHE_SIZE:
+            self.tiles.popitem(last=False)
+        return tile
+
+    def draw_static(self, qp, index, obstacles, lines):
+        # Only the tiles covering the viewport are drawn, so the cost does not grow with the scene
         w = self.width()
         h = self.height()
-        step = 20
-        x = step - self.offset.x() % step
-        wx = int(round(x + self.offset.x()))
-        y = step - self.offset.y() % step
-        wy = int(round(y + self.offset.y()))
         if self.over:
             qp.fillRect(0, 0, w, h, QtGui.QColor(255, 0, 0))
-        p1 = QtGui.QPen(QtGui.QBrush(QtGui.QColor(128, 128, 128)), 1)
-        p2 = QtGui.QPen(QtGui.QBrush(QtGui.QColor(0, 0, 0)), 2)
-        while x < w or y < h:
-            qp.setPen(p2 if (wy % 100) < step else p1)
-            qp.drawLine(0, y, w, y)
-            qp.setPen(p2 if (wx % 100) < step else p1)
-            qp.drawLine(x, 0, x, h)
-            y += step
-            x += step
-            wy += step
-            wx += step
-
-    def draw_lines(self, qp):
-        pen = QtGui.QPen(QtGui.QBrush(QtGui.QColor(255, 96, 32)), 3)
-        qp.setPen(pen)
-        for line in self.lines:
-            qp.drawLine(line[0], line[1], line[2], line[3])
-            # qp.drawLine(int(line[0]),int(line[1]),int(line[2]),int(line[3]))
+        ox = int(round(self.offset.x()))
+        oy = int(round(self.offset.y()))
+        for i in range(ox // TILE_SIZE, (ox + w) // TILE_SIZE + 1):
+            for j in range(oy // TILE_SIZE, (oy + h) // TILE_SIZE + 1):
+                tile = self.get_tile(i, j, index, obstacles, lines)
+                qp.drawImage(QtCore.QPoint(i * TILE_SIZE - ox, j * TILE_SIZE - oy), tile)
 
     def paintEvent(self, event):
+        t = stats.clock()
         qp = QtGui.QPainter()
         qp.begin(self)
         w = self.width()
         h = self.height()
-        self.offset = self.robot.pos - pt(w*0.5,h*0.5)
-        self.draw_grid(qp)
-        self.draw_lines(qp)
-        for o in self.obstacles:
-            o.draw(qp,self.offset)
-        self.robot.draw(qp,self.offset)
+        pose, sensor_angle, over = self.snapshot
+        self.offset = pt(pose[0, 0], pose[0, 1]) - pt(w*0.5,h*0.5)
+        # Scene geometry is replaced on load, never changed in place, so the tiles can be rendered from
+        # these references without holding up the simulation
+        with self.lock:
+            index = self.world.index
+            obstacles = self.world.obstacles
+            lines = self.world.lines
+        self.draw_static(qp, index, obstacles, lines)
+        if len(self.sprites) != pose.shape[0]:
+            self.sprites = [RobotSprite(r, self.sprite_cache) for r in self.world.robots]
+        for i, sprite in enumerate(self.sprites):
+            sprite.draw(qp, self.offset, pose[i], sensor_angle[i])
         qp.end()
-
-    def check_intersections(self):
-        for o in self.obstacles:
-            if check_intersection(self.robot, o):
-                self.over = True
-
-    def advance(self, dt):
-        if self.over:
-            return False
-        self.robot.advance(dt)
-        self.check_intersections()
-        self.update()
-        return True
+        stats.record('paint', stats.clock() - t)
 
     def shutdown(self):
-        self.robot.shutdown()
+        self.api.shutdown()
+        if self.shm_api:
+            self.shm_api.shutdown()
+        self.stop_recording()
 
 
 class MainWindow(QtWidgets.QMainWindow):
-    def __init__(self, scene_path, parent=None):
+    def __init__(self, scene_path, dt=SIM_DT, speed=SIM_SPEED, fps=MAX_FPS, record='', replay='', field=0.0,
+                 port=protocol.PORT, shm='', parent=None):
         super(MainWindow, self).__init__(parent, QtCore.Qt.WindowFlags())
-        self.setWindowTitle('Robot Simulator')
-        self.sandbox = SandboxWidget()
+        self.sandbox = SandboxWidget(port, shm)
+        self.setWindowTitle('Robot Simulator (port {})'.format(self.sandbox.api.port))
         self.setCentralWidget(self.sandbox)
+        # In replay mode the robots are posed from a memory-mapped log and no physics or controller runs
+        self.replay = Replay(replay) if replay else None
+        self.replay_tick = 0.0
+        self.replay_speed = speed if speed > 0 else 1.0
         self.last_time = 0
-        self.timer = QtCore.QTimer(self)
-        self.timer.timeout.connect(self.on_timer)
-        self.timer.start(10)
         self.setup_toolbar()
         self.done = False
-        self.paused = False
-        if self.sandbox.robot.api.done:
+        if self.sandbox.api.done:
             self.done = True
+        if self.replay and not scene_path:
+            scene_path = self.replay.scene
+        if record and not self.replay:
+            self.sandbox.record_path = record
+        # The step is set before the scene loads, as loading starts the recorder, which logs it
+        clock = self.sandbox.world.clock
+        clock.set_dt(dt)
+        clock.set_speed(speed)
+        self.sandbox.world.set_field_resolution(field)
         if scene_path:
             self.sandbox.load_scene(scene_path)
+        import simrobot
+        self.sim = SimulationThread(self.sandbox, clock)
+        self.sim.controller = simrobot
+        self.last_snapshot = None
+        self.timer = QtCore.QTimer(self)
+        self.timer.timeout.connect(self.on_timer)
+        self.timer.start(int(1000 / fps))
+        if self.replay:
+            self.seek(0)
+        elif not self.done:
+            self.sim.start()
 
     def setup_toolbar(self):
         tb = self.addToolBar('Actions')
@@ -332,66 +341,121 @@ class MainWindow(QtWidgets.QMainWindow):
         tb.addAction(QtGui.QIcon('restart.png'), 'Restart').triggered.connect(self.restart)
         tb.addAction(QtGui.QIcon('pause.png'), 'Pause').triggered.connect(self.pause)
         tb.addAction(QtGui.QIcon('play.png'), 'Play').triggered.connect(self.play)
+        if self.replay:
+            self.slider = QtWidgets.QSlider(QtCore.Qt.Horizontal)
+            self.slider.setRange(0, max(len(self.replay) - 1, 0))
+            self.slider.sliderMoved.connect(self.seek)
+            tb.addWidget(self.slider)
+            speed = QtWidgets.QDoubleSpinBox()
+            speed.setRange(-100.0, 100.0)
+            speed.setSingleStep(0.5)
+            speed.setSuffix('x')
+            speed.setValue(self.replay_speed)
+            speed.valueChanged.connect(self.set_replay_speed)
+            tb.addWidget(speed)
 
     def open_scene(self):
-        path, filter = QtWidgets.QFileDialog.getOpenFileName(self, 'Open Scene File', '.', '*.scene')
+        path, filter = QtWidgets.QFileDialog.getOpenFileName(self, 'Open Scene File', '.', 'Scenes (*.scene *.scene.bin)')
         if path:
             self.sandbox.load_scene(path)
 
     def restart(self):
-        self.sandbox.restart()
+        if self.replay:
+            self.seek(0)
+        else:
+            self.sandbox.restart()
 
     def pause(self):
-        self.paused = True
+        self.sim.paused = True
         self.last_time = 0
 
     def play(self):
-        self.paused = False
+        self.sim.paused = False
+
+    def seek(self, tick):
+        if len(self.replay) == 0:
+            return
+        self.replay_tick = min(max(float(tick), 0.0), len(self.replay) - 1.0)
+        self.sandbox.show_replay(self.replay, int(self.replay_tick))
+        if int(self.replay_tick) != self.slider.value():
+            self.slider.setValue(int(self.replay_tick))
+
+    def set_replay_speed(self, speed):
+        self.replay_speed = speed
+
+    def advance_replay(self):
+        # Playback position follows wall time at replay_speed simulated seconds per second; negative rewinds
+        current_time = time.time()
+        if self.last_time > 0 and not self.sim.paused:
+            self.seek(self.replay_tick + (current_time - self.last_time) * self.replay_speed / self.replay.dt)
+        self.last_time = current_time
 
     def shutdown(self):
+        self.timer.stop()
+        self.sim.stop()
         self.sandbox.shutdown()
 
     def on_timer(self):
-        if not self.paused:
-            dt = 0.1
-            current_time = time.time()
-            if self.last_time > 0:
-                dt = current_time - self.last_time
-            self.last_time = current_time
-            import simrobot
-            simrobot.run()
-            self.sandbox.advance(dt)
-
-
-def read_path_from_file(name):
-    try:
-        res = open(name, 'r').readline().strip()
-        if res.startswith('@'):
-            return read_path_from_file(res[1:])
-        return res
-    except FileNotFoundError:
-        return ''
+        if self.replay:
+            self.advance_replay()
+        # Repaint at most once per timer tick, and only when the simulation has moved on
+        if self.sandbox.snapshot is not self.last_snapshot:
+            self.last_snapshot = self.sandbox.snapshot
+            self.sandbox.update()
 
 
 def main():
+    if '--headless' in sys.argv:
+        import headless
+        sys.exit(headless.main([arg for arg in sys.argv[1:] if arg != '--headless']))
     scene_path = ''
+    dt = SIM_DT
+    speed = SIM_SPEED
+    fps = MAX_FPS
+    stats_period = 0.0
+    record = ''
+    replay = ''
+    field = 0.0
+    port = protocol.PORT
+    shm = ''
     for arg in sys.argv:
         if arg == 'dbg':
             server.DEBUG = True
         if arg.endswith('.scene'):
             scene_path = arg
-
-    if not scene_path and os.path.exists('cur.cfg'):
+        if arg.startswith('--dt='):
+            dt = float(arg[5:])
+        if arg.startswith('--speed='):
+            speed = float(arg[8:])
+        if arg.startswith('--fps='):
+            fps = float(arg[6:])
+        if arg.startswith('--stats='):
+            stats_period = float(arg[8:])
+        if arg.startswith('--record='):
+            record = arg[9:]
+        if arg.startswith('--replay='):
+            replay = arg[9:]
+        if arg.startswith('--field='):
+            field = float(arg[8:])
+        if arg.startswith('--port='):
+            port = int(arg[7:])
+        if arg.startswith('--shm='):
+            shm = arg[6:]
+
+    if not scene_path and not replay and os.path.exists('cur.cfg'):
         scene_path = read_path_from_file('cur.cfg')
 
     app = QtWidgets.QApplication(sys.argv)
-    w = MainWindow(scene_path)
+    w = MainWindow(scene_path, dt, speed, fps, record, replay, field, port, shm)
+    dumper = stats.start_dump(stats_period) if stats_period > 0 else None
     if not w.done:
         w.show()
         app.exec_()
     else:
         QtWidgets.QMessageBox.critical(None, 'Error', 'Simulator Already Running')
     w.shutdown()
+    if dumper:
+        dumper.stop()
 
 
 if __name__ == '__main__':
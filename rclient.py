@@ -1,36 +1,75 @@
 import socket
+import selectors
+import asyncio
+import concurrent.futures
 import threading
 import time
-import errno
 import sys
+import struct
+import json
+import protocol
+import shmem
+import stats
 
 DEBUG = False
 simhook=[None]
 
+# With session=True a client opens a session on connecting and is given a robot of its own (the robot
+# asked for, or any free one when robot is None); it raises IOError if the simulator has none to spare.
+# Clients send and receive on one socket bound to a free local port, as the server replies to the sender.
 class SocketRobot:
-    def __init__(self,host):
+    def __init__(self,host,robot=None,timeout=0.2,port=protocol.PORT,session=False):
         self.done = False
-        self.address = (host, 9080)
+        self.address = (host, port)
+        self.prefix = '@{} '.format(robot) if robot and not session else ''
+        self.robot = robot or 0
+        self.session = 0
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.request_id = 0
+        self.futures = {}
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(('0.0.0.0', 0))
+        self.sock.setblocking(0)
+        self.wake_recv, self.wake_send = socket.socketpair()
         self.receive_thread = threading.Thread(target=self.receive_loop)
         self.receive_thread.start()
-        self.send_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        self.sensor = None
-        self.encoders = None
+        if session:
+            message = 'HELLO' if robot is None else 'HELLO {}'.format(robot)
+            self.session, self.robot = self.wait(self.request(message, lambda v: (int(v[0]), int(v[1]))), (0, -1))
+            if self.session == 0:
+                self.shutdown()
+                raise IOError('No robot available on {}:{}'.format(host, port))
         self.send_message('RESET')
 
     def send_message(self, message):
-        self.send_sock.sendto(bytes(message, 'utf-8'), self.address)
+        self.sock.sendto(bytes(self.prefix + message, 'utf-8'), self.address)
+
+    def request(self, message, convert):
+        # Tags the command with '#id'; the server echoes the tag and the receive thread resolves
+        # the matching future with convert(reply values)
+        future = concurrent.futures.Future()
+        with self.lock:
+            self.request_id += 1
+            request_id = self.request_id
+            self.futures[request_id] = (future, convert)
+        future.request_id = request_id
+        self.send_message('#{} {}'.format(request_id, message))
+        return future
+
+    def wait(self, future, default):
+        try:
+            return future.result(self.timeout)
+        except concurrent.futures.TimeoutError:
+            with self.lock:
+                self.futures.pop(future.request_id, None)
+            return default
+
+    def read_encoders_async(self):
+        return self.request('E', lambda v: (v[0], v[1]))
 
     def read_encoders(self):
-        self.send_message('E')
-        result = (0.0, 0.0)
-        for i in range(10):
-            if self.encoders:
-                result = self.encoders
-                self.encoders = None
-                break
-            time.sleep(0.02)
-        return result
+        return self.wait(self.read_encoders_async(), (0.0, 0.0))
 
     def drive(self, l, r):
         self.send_message('V {} {}'.format(l, r))
@@ -41,16 +80,43 @@ class SocketRobot:
     def sensor_angle(self, a):
         self.send_message('SA {}'.format(a))
 
+    def sense_async(self):
+        return self.request('S', lambda v: v[0])
+
     def sense(self):
-        self.send_message('S')
-        result = -1.0
-        for i in range(10):
-            if not self.sensor is None:
-                result = self.sensor
-                self.sensor = None
-                break
-            time.sleep(0.02)
-        return result
+        return self.wait(self.sense_async(), -1.0)
+
+    def scan_async(self, start=-45, stop=45, count=91):
+        return self.request('SCAN {} {} {}'.format(start, stop, count), list)
+
+    def scan(self, start=-45, stop=45, count=91):
+        return self.wait(self.scan_async(start, stop, count), [])
+
+    def scan_angles_async(self, angles):
+        return self.request('SCANA ' + ' '.join(str(a) for a in angles), list)
+
+    def scan_angles(self, angles):
+        return self.wait(self.scan_angles_async(angles), [])
+
+    def sim_time_async(self):
+        return self.request('T', lambda v: v[0])
+
+    def sim_time(self):
+        return self.wait(self.sim_time_async(), -1.0)
+
+    def snapshot(self):
+        # Id of a server-side snapshot of the whole world, or 0 on timeout
+        return self.wait(self.request('SNAP', lambda v: int(v[0])), 0)
+
+    def restore(self, snapshot_id):
+        return self.wait(self.request('RESTORE {}'.format(snapshot_id), lambda v: bool(v[0])), False)
+
+    def drop(self, snapshot_id):
+        self.send_message('DROP {}'.format(snapshot_id))
+
+    def stats(self, reset=False):
+        # Timing summary of the simulator process, or None if it did not answer in time
+        return self.wait(self.request('STATS 1' if reset else 'STATS', dict), None)
 
     def __del__(self):
         if self.receive_thread:
@@ -58,74 +124,464 @@ class SocketRobot:
 
     def shutdown(self):
         if self.receive_thread:
-            self.stop()
+            if self.robot >= 0:
+                self.stop()
+            if self.session:
+                self.send_message('BYE')
             self.done = True
+            self.wake_send.send(b'x')
             self.receive_thread.join()
             self.receive_thread=None
+            with self.lock:
+                for future, convert in self.futures.values():
+                    future.cancel()
+                self.futures.clear()
+            self.sock.close()
+            self.wake_recv.close()
+            self.wake_send.close()
+
+    def process_response(self, response):
+        p = response.strip().split()
+        request_id = None
+        while p and p[0][0] in '@#':
+            if p[0][0] == '#':
+                request_id = int(p[0][1:])
+            p = p[1:]
+        if request_id is None or not p:
+            return
+        with self.lock:
+            entry = self.futures.pop(request_id, None)
+        if entry:
+            future, convert = entry
+            if p[0] == 'STATS':
+                future.set_result(convert(json.loads(' '.join(p[1:]))))
+            else:
+                future.set_result(convert([float(v) for v in p[1:]]))
 
     def receive_loop(self):
-        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        sock.bind(('0.0.0.0', 9081))
-        sock.setblocking(0)
+        selector = selectors.DefaultSelector()
+        selector.register(self.sock, selectors.EVENT_READ)
+        selector.register(self.wake_recv, selectors.EVENT_READ)
         while not self.done:
-            try:
-                data, addr = sock.recvfrom(256)
-                if len(data) == 0:
-                    time.sleep(0.01)
-                else:
-                    response = str(data, 'utf-8')
+            for key, events in selector.select():
+                if key.fileobj is not self.sock:
+                    continue
+                while True:
+                    try:
+                        data, addr = self.sock.recvfrom(65536)
+                    except (BlockingIOError, InterruptedError):
+                        break
+                    except OSError as e:
+                        print("Socket Error ({}): {}".format(e.errno, e.strerror))
+                        break
+                    response = str(data, 'utf-8', 'replace')
                     if DEBUG:
                         print("Received from '{}' data='{}'".format(addr, response))
                     try:
-                        p = response.strip().split()
-                        if p[0] == 'S':
-                            self.sensor = float(p[1])
-                        if p[0] == 'E':
-                            self.encoders = (float(p[1]), float(p[2]))
-                    except ValueError:
+                        self.process_response(response)
+                    except (ValueError, IndexError):
                         pass
-            except OSError as e:
-                errnum = e.errno
-                if errnum != errno.EAGAIN and errnum != errno.EWOULDBLOCK:
-                    reason = ''  # get_error_name(errnum)
-                    print("Socket Error ({}): {}".format(errnum, reason))
+        selector.close()
+
+
+class BinarySocketRobot:
+    def __init__(self, host, robot=None, timeout=0.2, port=protocol.PORT, session=False):
+        self.address = (host, port)
+        self.robot = robot or 0
+        self.session = 0
+        self.request_id = 0
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.settimeout(timeout)
+        if session:
+            values = self.exchange([('HELLO', [] if robot is None else [robot])])[0]
+            if not values or values[0] == 0:
+                self.sock.close()
+                self.sock = None
+                raise IOError('No robot available on {}:{}'.format(host, port))
+            self.session, self.robot = int(values[0]), int(values[1])
+        self.exchange([('RESET', [])])
+
+    def exchange(self, commands):
+        # Sends all (cmd, args) pairs in one datagram and returns each command's reply values,
+        # or None for commands whose reply did not arrive before the timeout
+        records = []
+        for cmd, args in commands:
+            self.request_id = (self.request_id + 1) & 0xFFFFFFFF
+            records.append((self.request_id, self.robot, protocol.OPCODE[cmd], args))
+        self.sock.sendto(protocol.pack(records), self.address)
+        pending = set(r[0] for r in records)
+        replies = {}
+        try:
+            while pending:
+                data, addr = self.sock.recvfrom(65536)
+                if not protocol.is_binary(data):
+                    continue
+                for request_id, robot, opcode, values in protocol.unpack(data):
+                    if request_id in pending:
+                        pending.discard(request_id)
+                        replies[request_id] = values
+        except socket.timeout:
+            pass
+        return [replies.get(r[0]) for r in records]
+
+    def drive(self, l, r):
+        self.exchange([('V', [l, r])])
+
+    def stop(self):
+        self.drive(0, 0)
+
+    def sensor_angle(self, a):
+        self.exchange([('SA', [a])])
+
+    def read_encoders(self):
+        values = self.exchange([('E', [])])[0]
+        return (values[0], values[1]) if values else (0.0, 0.0)
+
+    def sense(self):
+        values = self.exchange([('S', [])])[0]
+        return values[0] if values else -1.0
+
+    def scan(self, start=-45, stop=45, count=91):
+        return list(self.exchange([('SCAN', [start, stop, count])])[0] or [])
+
+    def scan_angles(self, angles):
+        return list(self.exchange([('SCANA', list(angles))])[0] or [])
+
+    def sim_time(self):
+        values = self.exchange([('T', [])])[0]
+        return values[0] if values else -1.0
+
+    def snapshot(self):
+        values = self.exchange([('SNAP', [])])[0]
+        return int(values[0]) if values else 0
+
+    def restore(self, snapshot_id):
+        values = self.exchange([('RESTORE', [snapshot_id])])[0]
+        return bool(values and values[0])
+
+    def drop(self, snapshot_id):
+        self.exchange([('DROP', [snapshot_id])])
+
+    def shutdown(self):
+        if self.sock:
+            if self.session:
+                self.exchange([('V', [0, 0]), ('BYE', [])])
+            else:
+                self.stop()
+            self.sock.close()
+            self.sock = None
+
+
+class AsyncRobot(asyncio.DatagramProtocol):
+    # asyncio client over the binary protocol; any number of requests can be in flight at once.
+    # Create with: robot = await AsyncRobot.connect(host)
+    def __init__(self, host, robot=None, timeout=0.2, port=protocol.PORT):
+        self.address = (host, port)
+        self.robot = robot or 0
+        self.session = 0
+        self.timeout = timeout
+        self.transport = None
+        self.request_id = 0
+        self.futures = {}
+
+    @classmethod
+    async def connect(cls, host, robot=None, timeout=0.2, port=protocol.PORT, session=False):
+        loop = asyncio.get_running_loop()
+        transport, client = await loop.create_datagram_endpoint(lambda: cls(host, robot, timeout, port),
+                                                                local_addr=('0.0.0.0', 0))
+        if session:
+            values = (await client.exchange([('HELLO', [] if robot is None else [robot])]))[0]
+            if not values or values[0] == 0:
+                client.close()
+                raise IOError('No robot available on {}:{}'.format(host, port))
+            client.session, client.robot = int(values[0]), int(values[1])
+        await client.exchange([('RESET', [])])
+        return client
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        if not protocol.is_binary(data):
+            return
+        try:
+            records = protocol.unpack(data)
+        except (ValueError, struct.error):
+            return
+        for request_id, robot, opcode, values in records:
+            future = self.futures.pop(request_id, None)
+            if future and not future.done():
+                future.set_result(values)
+
+    def send(self, commands):
+        # Sends all (cmd, args) pairs in one datagram and returns one future per command
+        loop = asyncio.get_running_loop()
+        records = []
+        futures = []
+        for cmd, args in commands:
+            self.request_id = (self.request_id + 1) & 0xFFFFFFFF
+            future = loop.create_future()
+            self.futures[self.request_id] = future
+            records.append((self.request_id, self.robot, protocol.OPCODE[cmd], args))
+            futures.append(future)
+        self.transport.sendto(protocol.pack(records), self.address)
+        return futures
+
+    async def exchange(self, commands):
+        futures = self.send(commands)
+        await asyncio.wait(futures, timeout=self.timeout)
+        results = []
+        for future in futures:
+            if future.done():
+                results.append(future.result())
+            else:
+                future.cancel()
+                results.append(None)
+        return results
+
+    async def drive(self, l, r):
+        await self.exchange([('V', [l, r])])
+
+    async def stop(self):
+        await self.drive(0, 0)
+
+    async def sensor_angle(self, a):
+        await self.exchange([('SA', [a])])
+
+    async def read_encoders(self):
+        values = (await self.exchange([('E', [])]))[0]
+        return (values[0], values[1]) if values else (0.0, 0.0)
+
+    async def sense(self):
+        values = (await self.exchange([('S', [])]))[0]
+        return values[0] if values else -1.0
+
+    async def scan(self, start=-45, stop=45, count=91):
+        return list((await self.exchange([('SCAN', [start, stop, count])]))[0] or [])
+
+    async def scan_angles(self, angles):
+        return list((await self.exchange([('SCANA', list(angles))]))[0] or [])
+
+    async def sim_time(self):
+        values = (await self.exchange([('T', [])]))[0]
+        return values[0] if values else -1.0
+
+    async def snapshot(self):
+        values = (await self.exchange([('SNAP', [])]))[0]
+        return int(values[0]) if values else 0
+
+    async def restore(self, snapshot_id):
+        values = (await self.exchange([('RESTORE', [snapshot_id])]))[0]
+        return bool(values and values[0])
+
+    async def drop(self, snapshot_id):
+        await self.exchange([('DROP', [snapshot_id])])
+
+    def close(self):
+        if self.transport:
+            if self.session:
+                # Fire and forget, as close cannot wait for the reply
+                self.transport.sendto(protocol.pack([(0, self.robot, protocol.OPCODE['V'], (0, 0)),
+                                                     (0, self.robot, protocol.OPCODE['BYE'], ())]), self.address)
+                self.session = 0
+            self.transport.close()
+            self.transport = None
+
+
+class SharedMemoryRobot:
+    # Same-host client over the simulator's shared-memory segment (see shmem.py): commands and replies go
+    # through channel `robot` without sockets or text, and telemetry() reads the robot's last stepped state
+    # without a round trip at all
+    def __init__(self, name=shmem.NAME, robot=0, timeout=0.2):
+        self.segment = shmem.Segment.attach(name)
+        if robot >= self.segment.channels:
+            self.segment.close()
+            raise IOError('{} has no channel for robot {}'.format(name, robot))
+        self.robot = robot
+        self.timeout = timeout
+        self.request_id = 0
+        # Replies left over from requests that timed out
+        self.segment.pop(self.segment.replies, robot)
+        self.exchange([('RESET', [])])
+
+    def exchange(self, commands):
+        # Same contract as BinarySocketRobot.exchange: each command's reply values, or None on timeout.
+        # Commands go out in batches the request ring can hold. IOError if the simulator has stopped taking
+        # requests off the ring, ValueError if a command has more arguments than a slot holds.
+        results = []
+        for k in range(0, len(commands), self.segment.slots):
+            results += self.exchange_batch(commands[k:k + self.segment.slots])
+        return results
+
+    def exchange_batch(self, commands):
+        segment = self.segment
+        records = []
+        for cmd, args in commands:
+            self.request_id = (self.request_id + 1) & 0xFFFFFFFF
+            records.append((self.request_id, protocol.OPCODE[cmd], args))
+        start = time.perf_counter()
+        # Requests left by an earlier timeout may still be taking up room; their replies are of no use now,
+        # and the simulator takes no more requests while the reply ring is full
+        while segment.free(segment.requests, self.robot) < len(records):
+            segment.pop(segment.replies, self.robot)
+            if time.perf_counter() - start > self.timeout:
+                raise IOError('The simulator is not reading requests for robot {}'.format(self.robot))
+            shmem.yield_cpu()
+        segment.push(segment.requests, self.robot, records)
+        pending = set(r[0] for r in records)
+        replies = {}
+        while pending:
+            for request_id, opcode, values in segment.pop(segment.replies, self.robot):
+                if request_id in pending:
+                    pending.discard(request_id)
+                    replies[request_id] = values
+            if pending:
+                if time.perf_counter() - start > self.timeout:
+                    break
+                shmem.yield_cpu()
+        return [replies.get(r[0]) for r in records]
+
+    def telemetry(self):
+        # dict of time, pose, velocity, clicks, sensor_angle, sensor and collided, or None before the first step
+        record = self.segment.read_telemetry(self.robot)
+        if record is None:
+            return None
+        return {'time': float(record['time']), 'pose': tuple(record['pose'].tolist()),
+                'velocity': tuple(record['velocity'].tolist()), 'clicks': tuple(record['clicks'].tolist()),
+                'sensor_angle': float(record['sensor_angle']), 'sensor': float(record['sensor']),
+                'collided': bool(record['collided'])}
+
+    def drive(self, l, r):
+        self.exchange([('V', [l, r])])
+
+    def stop(self):
+        self.drive(0, 0)
+
+    def sensor_angle(self, a):
+        self.exchange([('SA', [a])])
+
+    def read_encoders(self):
+        values = self.exchange([('E', [])])[0]
+        return (values[0], values[1]) if values else (0.0, 0.0)
+
+    def sense(self):
+        values = self.exchange([('S', [])])[0]
+        return values[0] if values else -1.0
+
+    def scan(self, start=-45, stop=45, count=91):
+        return list(self.exchange([('SCAN', [start, stop, count])])[0] or [])
+
+    def scan_angles(self, angles):
+        return list(self.exchange([('SCANA', list(angles))])[0] or [])
+
+    def sim_time(self):
+        values = self.exchange([('T', [])])[0]
+        return values[0] if values else -1.0
+
+    def snapshot(self):
+        values = self.exchange([('SNAP', [])])[0]
+        return int(values[0]) if values else 0
+
+    def restore(self, snapshot_id):
+        values = self.exchange([('RESTORE', [snapshot_id])])[0]
+        return bool(values and values[0])
+
+    def drop(self, snapshot_id):
+        self.exchange([('DROP', [snapshot_id])])
+
+    def shutdown(self):
+        if self.segment:
+            self.stop()
+            self.segment.close()
+            self.segment = None
 
 
 class DirectRobot:
-    def __init__(self):
-        self.hook = simhook[0]
+    def __init__(self, robot=0):
+        self.robot = robot
+
+    @property
+    def hook(self):
+        if self.robot < len(simhook):
+            return simhook[self.robot]
+        return None
 
+    # Commands go through execute like socket commands do, so they are timed and recorded the same way
     def drive(self,l,r):
         if self.hook:
-            self.hook.command_velocity([l,r])
+            self.hook.execute('V', [l,r])
 
     def stop(self):
         self.drive(0,0)
 
     def sensor_angle(self, a):
         if self.hook and (isinstance(a,int) or isinstance(a,float)):
-            self.hook.command_sensor_angle([a])
+            self.hook.execute('SA', [a])
 
     def read_encoders(self):
         if self.hook:
-            s=self.hook.command_encoders(None)
-            s=s.strip().split()
-            return (float(s[1]),float(s[2]))
+            e=self.hook.execute('E', [])
+            return (float(e[0]),float(e[1]))
         return (0,0)
 
     def sense(self):
         if self.hook:
-            s=self.hook.command_sensor(None)
-            s=s.strip().split()
-            return float(s[1])
+            return self.hook.execute('S', [])[0]
         return -1
 
+    def exchange(self, commands):
+        if self.hook:
+            return [self.hook.execute(cmd, args) for cmd, args in commands]
+        return [None] * len(commands)
+
+    def scan(self, start=-45, stop=45, count=91):
+        if self.hook:
+            return self.hook.execute('SCAN', [start,stop,count]) or []
+        return []
+
+    def scan_angles(self, angles):
+        if self.hook:
+            return self.hook.execute('SCANA', list(angles)) or []
+        return []
+
+    def sim_time(self):
+        if self.hook:
+            return self.hook.world.time
+        return -1.0
+
+    def snapshot(self):
+        if self.hook:
+            return int(self.hook.execute('SNAP', [])[0])
+        return 0
+
+    def restore(self, snapshot_id):
+        if self.hook:
+            return bool(self.hook.execute('RESTORE', [snapshot_id])[0])
+        return False
+
+    def drop(self, snapshot_id):
+        if self.hook:
+            self.hook.execute('DROP', [snapshot_id])
+
+    def stats(self, reset=False):
+        result = stats.summary()
+        if reset:
+            stats.reset()
+        return result
+
 class Robot:
-    def __init__(self, param):
+    # param is 1 for the in-process simulator, a host name for UDP, or 'shm:' / 'shm:NAME' for the
+    # shared-memory segment of a simulator on this machine
+    def __init__(self, param, robot=None, binary=False, port=protocol.PORT, session=False):
         if isinstance(param,int):
-            self.impl = DirectRobot()
+            self.impl = DirectRobot(robot or 0)
         if isinstance(param,str):
-            self.impl = SocketRobot(param)
+            if param.startswith('shm:'):
+                self.impl = SharedMemoryRobot(param[4:] or shmem.NAME, robot or 0)
+            elif binary:
+                self.impl = BinarySocketRobot(param, robot, port=port, session=session)
+            else:
+                self.impl = SocketRobot(param, robot, port=port, session=session)
 
     def drive(self,l,r):
         self.impl.drive(l,r)
@@ -142,6 +598,41 @@ class Robot:
     def sense(self):
         return self.impl.sense()
 
+    def scan(self, start=-45, stop=45, count=91):
+        return self.impl.scan(start, stop, count)
+
+    def scan_angles(self, angles):
+        return self.impl.scan_angles(angles)
+
+    def exchange(self, commands):
+        return self.impl.exchange(commands)
+
+    def sim_time(self):
+        return self.impl.sim_time()
+
+    def snapshot(self):
+        return self.impl.snapshot()
+
+    def restore(self, snapshot_id):
+        return self.impl.restore(snapshot_id)
+
+    def drop(self, snapshot_id):
+        self.impl.drop(snapshot_id)
+
+    def stats(self, reset=False):
+        if hasattr(self.impl, 'stats'):
+            return self.impl.stats(reset)
+        return None
+
+    def telemetry(self):
+        if hasattr(self.impl, 'telemetry'):
+            return self.impl.telemetry()
+        return None
+
+    def shutdown(self):
+        if hasattr(self.impl, 'shutdown'):
+            self.impl.shutdown()
+
 
 def unit_test():
     r = Robot()
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+import sys
+import os
+import struct
+import queue
+import argparse
+import threading
+import numpy as np
+
+# A trajectory log is a header followed by one fixed-size record per robot per tick, appended as the run
+# goes, so a log of n robots is an array of shape (ticks, n) that can be memory-mapped for replay.
+# Commands received by the robots go to a text side file, <log>.cmd, one 'tick robot command args' line each.
+MAGIC = b'PRTR'
+VERSION = 1
+HEADER = struct.Struct('<4sIId256s')
+RECORD = np.dtype([('tick', '<u4'), ('time', '<f8'), ('pose', '<f8', 3), ('velocity', '<f8', 2),
+                   ('sensor_angle', '<f8'), ('sensor', '<f8'), ('clicks', '<i8', 2), ('collided', 'u1')])
+COMMAND_SUFFIX = '.cmd'
+
+
+class Recorder:
+    def __init__(self, world, path, scene=''):
+        self.world = world
+        self.path = path
+        self.count = len(world.robots)
+        self.ticks = 0
+        self.queue = queue.Queue()
+        self.f = open(path, 'wb')
+        self.f.write(HEADER.pack(MAGIC, VERSION, self.count, world.clock.dt, scene.encode('utf-8')[:256]))
+        self.commands = open(path + COMMAND_SUFFIX, 'w')
+        self.thread = threading.Thread(target=self.write_loop)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def capture(self):
+        # Called after every world step; only copies the arrays, the writer thread does the I/O
+        world = self.world
+        records = np.empty(self.count, dtype=RECORD)
+        records['tick'] = self.ticks
+        records['time'] = world.time
+        records['pose'] = world.pose
+        records['velocity'] = world.velocity
+        records['sensor_angle'] = world.sensor_angle
+        records['sensor'] = world.sensor_value
+        records['clicks'] = world.clicks
+        records['collided'] = world.collided
+        self.queue.put((self.f, records.tobytes()))
+        self.ticks += 1
+
+    def log_command(self, robot, cmd, args):
+        line = ' '.join([str(self.ticks), str(robot), cmd] + [repr(float(a)) for a in args]) + '\n'
+        self.queue.put((self.commands, line))
+
+    def write_loop(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            f, data = item
+            f.write(data)
+            if self.queue.empty():
+                self.f.flush()
+                self.commands.flush()
+
+    def close(self):
+        if self.thread:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+            self.f.close()
+            self.commands.close()
+
+
+class Replay:
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            magic, version, count, dt, scene = HEADER.unpack(f.read(HEADER.size))
+        if magic != MAGIC or version != VERSION:
+            raise IOError('{} is not a trajectory log'.format(path))
+        self.path = path
+        self.count = count
+        self.dt = dt
+        self.scene = scene.rstrip(b'\0').decode('utf-8')
+        # A log that is still being written may end in a partial tick, which is ignored
+        ticks = (os.path.getsize(path) - HEADER.size) // (count * RECORD.itemsize)
+        if ticks > 0:
+            self.records = np.memmap(path, dtype=RECORD, mode='r', offset=HEADER.size, shape=(ticks, count))
+        else:
+            self.records = np.zeros((0, count), dtype=RECORD)
+
+    def __len__(self):
+        return self.records.shape[0]
+
+    def commands(self):
+        # (tick, robot, command, args) for every logged command
+        result = []
+        try:
+            with open(self.path + COMMAND_SUFFIX, 'r') as f:
+                for line in f:
+                    p = line.split()
+                    if len(p) >= 3:
+                        result.append((int(p[0]), int(p[1]), p[2], [float(a) for a in p[3:]]))
+        except IOError:
+            pass
+        return result
+
+    def apply(self, world, tick):
+        # Puts the world's robots in their logged state at tick, without stepping any physics
+        frame = self.records[tick]
+        n = min(self.count, len(world.robots))
+        world.pose[:n] = frame['pose'][:n]
+        world.velocity[:n] = frame['velocity'][:n]
+        world.sensor_angle[:n] = frame['sensor_angle'][:n]
+        world.sensor_value[:n] = frame['sensor'][:n]
+        world.collided[:n] = frame['collided'][:n].astype(bool)
+        world.update_shapes()
+
+
+def diff(a, b, tolerance=1e-9):
+    # Compares two logs tick by tick and returns (ticks compared, first diverging tick or None, max pose error)
+    ticks = min(len(a), len(b))
+    count = min(a.count, b.count)
+    if ticks == 0:
+        return 0, None, 0.0
+    error = np.abs(a.records['pose'][:ticks, :count] - b.records['pose'][:ticks, :count]).max(axis=(1, 2))
+    diverged = np.nonzero(error > tolerance)[0]
+    return ticks, int(diverged[0]) if len(diverged) else None, float(error.max())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Inspect or compare trajectory logs')
+    sub = parser.add_subparsers(dest='action')
+    sub.required = True
+    p = sub.add_parser('info', help='Summarize a log')
+    p.add_argument('log')
+    p = sub.add_parser('diff', help='Find where two logs diverge')
+    p.add_argument('log1')
+    p.add_argument('log2')
+    p.add_argument('--tolerance', type=float, default=1e-9, help='Largest pose difference treated as equal')
+    args = parser.parse_args(argv)
+
+    if args.action == 'info':
+        log = Replay(args.log)
+        print('{}: scene {}, {} robots, {} ticks of {} s, {} commands'.format(
+            args.log, log.scene or '<none>', log.count, len(log), log.dt, len(log.commands())))
+        if len(log):
+            last = log.records[-1]
+            for i in range(log.count):
+                print('robot {}: pose ({:.1f}, {:.1f}, {:.1f}){}'.format(
+                    i, last['pose'][i][0], last['pose'][i][1], last['pose'][i][2],
+                    ' crashed' if last['collided'][i] else ''))
+        return 0
+    ticks, tick, error = diff(Replay(args.log1), Replay(args.log2), args.tolerance)
+    if tick is None:
+        print('identical over {} ticks (max pose difference {:g})'.format(ticks, error))
+        return 0
+    print('diverged at tick {} of {} (max pose difference {:g})'.format(tick, ticks, error))
+    return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
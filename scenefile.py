@@ -0,0 +1,112 @@
+import os
+import struct
+import numpy as np
+
+# Compiled scenes live next to the text file as <name>.scene.bin: a header followed by float64 arrays,
+# obstacles (n, 5), obstacle corners (n, 4, 2), lines (m, 4) and start poses (k, 3), in that order.
+# The header records the size and mtime of the text file it was built from.
+MAGIC = b'PRSB'
+VERSION = 1
+HEADER = struct.Struct('<4sIQdQQQ')
+CACHE_SUFFIX = '.bin'
+
+
+def parse_scene(path):
+    obstacles = []
+    lines = []
+    poses = []
+    with open(path, 'r') as f:
+        for line in f:
+            p = line.split()
+            try:
+                p = [float(v) for v in p]
+            except ValueError:
+                continue
+            if len(p) == 5:
+                obstacles.append(p)
+            elif len(p) == 4:
+                lines.append(p)
+            elif len(p) == 3:
+                poses.append(p)
+    return (np.array(obstacles, dtype=float).reshape(-1, 5), np.array(lines, dtype=float).reshape(-1, 4),
+            np.array(poses, dtype=float).reshape(-1, 3))
+
+
+def obstacle_corners(obstacles):
+    # Corners of each obstacle: the w x h rectangle rotated by angle degrees, then moved to (x, y)
+    w = 0.5 * obstacles[:, 2:3]
+    h = 0.5 * obstacles[:, 3:4]
+    local = np.stack((np.concatenate((-w, w, w, -w), axis=1), np.concatenate((-h, -h, h, h), axis=1)), axis=2)
+    a = np.radians(obstacles[:, 4:5])
+    c = np.cos(a)
+    s = np.sin(a)
+    corners = np.empty(local.shape)
+    corners[:, :, 0] = local[:, :, 0] * c - local[:, :, 1] * s + obstacles[:, 0:1]
+    corners[:, :, 1] = local[:, :, 0] * s + local[:, :, 1] * c + obstacles[:, 1:2]
+    return corners
+
+
+def compile_scene(path, cache_path=None):
+    obstacles, lines, poses = parse_scene(path)
+    corners = obstacle_corners(obstacles)
+    cache_path = cache_path or path + CACHE_SUFFIX
+    st = os.stat(path)
+    # Written under a temporary name and renamed, so concurrent workers never see a partial file
+    tmp_path = '{}.{}.tmp'.format(cache_path, os.getpid())
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, st.st_size, st.st_mtime, len(obstacles), len(lines), len(poses)))
+        for a in (obstacles, corners, lines, poses):
+            f.write(np.ascontiguousarray(a, dtype='<f8').tobytes())
+    os.replace(tmp_path, cache_path)
+    return obstacles, corners, lines, poses
+
+
+def map_scene(cache_path, path=None):
+    # Returns read-only memory-mapped arrays, or None if the cache is missing, corrupt or older than path
+    try:
+        with open(cache_path, 'rb') as f:
+            header = f.read(HEADER.size)
+        magic, version, size, mtime, n, m, k = HEADER.unpack(header)
+    except (IOError, struct.error):
+        return None
+    if magic != MAGIC or version != VERSION:
+        return None
+    if path:
+        st = os.stat(path)
+        if st.st_size != size or st.st_mtime != mtime:
+            return None
+    total = n * 5 + n * 8 + m * 4 + k * 3
+    if os.path.getsize(cache_path) != HEADER.size + 8 * total:
+        return None
+    if total == 0:
+        data = np.zeros(0)
+    else:
+        data = np.memmap(cache_path, dtype='<f8', mode='r', offset=HEADER.size, shape=(total,))
+    obstacles = data[:n * 5].reshape(n, 5)
+    corners = data[n * 5:n * 13].reshape(n, 4, 2)
+    lines = data[n * 13:n * 13 + m * 4].reshape(m, 4)
+    poses = data[n * 13 + m * 4:].reshape(k, 3)
+    return obstacles, corners, lines, poses
+
+
+def load_scene(path):
+    # Compiled arrays for a scene file: the cache when it is current, otherwise rebuilt from the text.
+    # A .scene.bin path is mapped directly.
+    if path.endswith(CACHE_SUFFIX):
+        arrays = map_scene(path)
+        if arrays is None:
+            raise IOError('{} is not a compiled scene'.format(path))
+        return arrays
+    cache_path = path + CACHE_SUFFIX
+    arrays = map_scene(cache_path, path)
+    if arrays is not None:
+        return arrays
+    try:
+        compiled = compile_scene(path, cache_path)
+    except (IOError, OSError):
+        if not os.path.exists(path):
+            raise
+        # Read-only directory: use the parsed arrays without caching them
+        obstacles, lines, poses = parse_scene(path)
+        return obstacles, obstacle_corners(obstacles), lines, poses
+    return map_scene(cache_path, path) or compiled
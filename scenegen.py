@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+import sys
+import random
+import argparse
+
+
+def maze(cols, rows, cell=100.0, wall=20.0, seed=0):
+    # Perfect maze carved by a randomized depth-first search. Returns (obstacles, poses): every wall
+    # segment left standing is one x y w h angle rectangle, and the robot starts in the top-left cell.
+    rng = random.Random(seed)
+    visited = [[False] * rows for i in range(cols)]
+    # open_east[i][j] / open_south[i][j]: the wall to the right of / below cell (i, j) was removed
+    open_east = [[False] * rows for i in range(cols)]
+    open_south = [[False] * rows for i in range(cols)]
+    stack = [(0, 0)]
+    visited[0][0] = True
+    while stack:
+        i, j = stack[-1]
+        neighbours = [(i + di, j + dj) for di, dj in ((1, 0), (-1, 0), (0, 1), (0, -1))
+                      if 0 <= i + di < cols and 0 <= j + dj < rows and not visited[i + di][j + dj]]
+        if not neighbours:
+            stack.pop()
+            continue
+        ni, nj = rng.choice(neighbours)
+        if ni != i:
+            open_east[min(i, ni)][j] = True
+        else:
+            open_south[i][min(j, nj)] = True
+        visited[ni][nj] = True
+        stack.append((ni, nj))
+    obstacles = []
+    length = cell + wall
+    for i in range(cols):
+        for j in range(rows):
+            x = i * cell
+            y = j * cell
+            if j == 0:
+                obstacles.append((x + 0.5 * cell, y, length, wall, 0))
+            if i == 0:
+                obstacles.append((x, y + 0.5 * cell, wall, length, 0))
+            if not open_east[i][j]:
+                obstacles.append((x + cell, y + 0.5 * cell, wall, length, 0))
+            if not open_south[i][j]:
+                obstacles.append((x + 0.5 * cell, y + cell, length, wall, 0))
+    return obstacles, [(0.5 * cell, 0.5 * cell, 180)]
+
+
+def clutter(count, extent=2000.0, min_size=10.0, max_size=60.0, clearance=100.0, seed=0):
+    # count randomly placed and rotated boxes in an extent x extent square, keeping a disc of radius
+    # clearance around the central start pose free
+    rng = random.Random(seed)
+    cx = cy = 0.5 * extent
+    obstacles = []
+    while len(obstacles) < count:
+        w = rng.uniform(min_size, max_size)
+        h = rng.uniform(min_size, max_size)
+        x = rng.uniform(0, extent)
+        y = rng.uniform(0, extent)
+        if (x - cx) ** 2 + (y - cy) ** 2 < (clearance + 0.5 * max(w, h) * 1.5) ** 2:
+            continue
+        obstacles.append((x, y, w, h, rng.uniform(0, 90)))
+    return obstacles, [(cx, cy, 0)]
+
+
+def write_scene(f, obstacles, poses=(), lines=()):
+    for o in obstacles:
+        f.write('{:g} {:g} {:g} {:g} {:g}\n'.format(*o))
+    for line in lines:
+        f.write('{:g} {:g} {:g} {:g}\n'.format(*line))
+    for p in poses:
+        f.write('{:g} {:g} {:g}\n'.format(*p))
+
+
+def save_scene(path, obstacles, poses=(), lines=()):
+    with open(path, 'w') as f:
+        write_scene(f, obstacles, poses, lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Generate maze or clutter scenes in the .scene format')
+    sub = parser.add_subparsers(dest='kind')
+    sub.required = True
+    p = sub.add_parser('maze', help='Perfect maze of cols x rows corridors')
+    p.add_argument('cols', type=int)
+    p.add_argument('rows', type=int, nargs='?', default=0, help='Defaults to cols')
+    p.add_argument('--cell', type=float, default=100.0, help='Corridor pitch')
+    p.add_argument('--wall', type=float, default=20.0, help='Wall thickness')
+    p = sub.add_parser('clutter', help='Randomly placed boxes')
+    p.add_argument('count', type=int)
+    p.add_argument('--extent', type=float, default=2000.0, help='Side of the square field')
+    p.add_argument('--min-size', type=float, default=10.0)
+    p.add_argument('--max-size', type=float, default=60.0)
+    p.add_argument('--clearance', type=float, default=100.0, help='Free radius around the start pose')
+    for p in sub.choices.values():
+        p.add_argument('--seed', type=int, default=0)
+        p.add_argument('--output', '-o', default='', help='Scene file to write (default: stdout)')
+    args = parser.parse_args(argv)
+
+    if args.kind == 'maze':
+        obstacles, poses = maze(args.cols, args.rows or args.cols, args.cell, args.wall, args.seed)
+    else:
+        obstacles, poses = clutter(args.count, args.extent, args.min_size, args.max_size, args.clearance, args.seed)
+    if args.output:
+        save_scene(args.output, obstacles, poses)
+    else:
+        write_scene(sys.stdout, obstacles, poses)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,10 +1,25 @@
 import socket
+import selectors
 import threading
 import time
 import errno
 import sys
+import struct
+import protocol
+import shmem
+import stats
 
 DEBUG = False
+BUFFER_SIZE = 65536
+HOST = '127.0.0.1'
+SESSION_TIMEOUT = 60.0
+# Shared-memory polling: keep spinning this long after the last request, then check every POLL_INTERVAL,
+# and once IDLE_TIME has passed without requests only every IDLE_INTERVAL, so that an unused segment costs
+# next to no CPU; the first request after a pause waits at most that long
+SPIN_TIME = 0.002
+POLL_INTERVAL = 0.0002
+IDLE_TIME = 0.5
+IDLE_INTERVAL = 0.01
 
 def get_error_name(e):
     if e == errno.EPERM:
@@ -178,54 +193,255 @@ def get_error_name(e):
     return "Unknown"
 
 
+class Session:
+    def __init__(self, session_id, robot, address):
+        self.id = session_id
+        self.robot = robot
+        self.address = address
+        self.last_seen = time.time()
+
+
 class API:
-    def __init__(self, callback):
-        self.receive_thread = threading.Thread(target=self.receive_loop)
+    # port 0 binds any free port, which is then available as self.port.
+    # A client that sends HELLO [robot] gets a session id and a robot of its own (any unclaimed one below
+    # robots(), or the one asked for if it is free); everything it sends afterwards goes to that robot,
+    # whatever robot the message names, until it sends BYE or is silent for SESSION_TIMEOUT seconds.
+    # Commands from other addresses to a robot held by a live session are ignored.
+    def __init__(self, callback, execute=None, host=HOST, port=protocol.PORT, robots=None):
         self.done = False
         self.callback = callback
+        self.execute = execute
+        self.robots = robots
+        self.sessions = {}
+        self.next_session = 1
+        self.port = port
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            self.sock.bind((host, port))
+            self.sock.setblocking(0)
+            self.port = self.sock.getsockname()[1]
+        except OSError as e:
+            self.done=True
+            print("Failed to bind socket")
+        self.wake_recv, self.wake_send = socket.socketpair()
+        self.receive_thread = threading.Thread(target=self.receive_loop)
         self.receive_thread.start()
-        time.sleep(0.5)
 
     def shutdown(self):
         self.done=True
-        time.sleep(0.1)
+        if self.receive_thread:
+            self.wake_send.send(b'x')
+            self.receive_thread.join()
+            self.receive_thread = None
+            self.sock.close()
+            self.wake_recv.close()
+            self.wake_send.close()
+
+    def open_session(self, address, robot=None):
+        # Returns (session id, robot), or (0, -1) if no suitable robot is free
+        now = time.time()
+        for key in [key for key, s in self.sessions.items() if now - s.last_seen > SESSION_TIMEOUT]:
+            del self.sessions[key]
+        self.sessions.pop(address, None)
+        claimed = set(s.robot for s in self.sessions.values())
+        count = self.robots() if self.robots else None
+        if robot is None:
+            robot = 0
+            while robot in claimed:
+                robot += 1
+        if robot < 0 or robot in claimed or (count is not None and robot >= count):
+            return 0, -1
+        session = Session(self.next_session, robot, address)
+        self.next_session += 1
+        self.sessions[address] = session
+        if DEBUG:
+            print("Session {} for '{}' on robot {}".format(session.id, address, robot))
+        return session.id, robot
+
+    def close_session(self, address):
+        return self.sessions.pop(address, None) is not None
+
+    def route(self, address, robot):
+        # The robot a message from address addresses: its session's robot, if it has one, otherwise the robot
+        # it names, or None when that robot belongs to another client's live session
+        now = time.time()
+        session = self.sessions.get(address)
+        if session is None:
+            for s in self.sessions.values():
+                if s.robot == robot and now - s.last_seen <= SESSION_TIMEOUT:
+                    return None
+            return robot
+        session.last_seen = now
+        return session.robot
+
+    def process_binary(self, data, address):
+        # Every record gets a reply record with the same request id, so clients can match them up
+        replies = []
+        for request_id, robot, opcode, args in protocol.unpack(data):
+            values = None
+            cmd = protocol.OPCODES[opcode] if 0 < opcode < len(protocol.OPCODES) else ''
+            if cmd == 'HELLO':
+                values = self.open_session(address, int(args[0]) if args else None)
+            elif cmd == 'BYE':
+                values = [1 if self.close_session(address) else 0]
+            else:
+                target = self.route(address, robot)
+                if target is not None:
+                    robot = target
+                    if self.execute and cmd:
+                        values = self.execute(cmd, list(args), robot)
+            replies.append((request_id, robot, opcode, values or ()))
+        return protocol.pack(replies)
+
+    def process_text(self, data, address):
+        words = str(data,encoding='utf-8').strip().split()
+        if DEBUG:
+            print("Received from '{}' data='{}'".format(address, data))
+        if len(words) < 1:
+            return
+        # Leading '@robot' and '#request' tags are echoed back in front of the reply
+        tags = []
+        robot = 0
+        while words and words[0][0] in '@#':
+            if words[0][0] == '@':
+                robot = int(words[0][1:])
+            tags.append(words[0])
+            words = words[1:]
+        if len(words) < 1:
+            return
+        cmd = words[0]
+        args = [float(a) for a in words[1:]]
+        if cmd == 'STATS':
+            # 'STATS' replies with the timing summary as JSON; 'STATS 1' also clears it afterwards
+            response = 'STATS ' + stats.to_json()
+            if args and args[0]:
+                stats.reset()
+        elif cmd == 'HELLO':
+            response = 'HELLO {} {}'.format(*self.open_session(address, int(args[0]) if args else None))
+        elif cmd == 'BYE':
+            response = 'BYE {}'.format(1 if self.close_session(address) else 0)
+        else:
+            robot = self.route(address, robot)
+            response = self.callback(cmd, args, robot) if robot is not None else ''
+        if response:
+            response = ' '.join(tags + [response])
+            if DEBUG:
+                print("Sending response: '{}'".format(response))
+            self.sock.sendto(bytes(response,'utf-8'), address)
+
+    def process_pending(self):
+        # The socket is non-blocking: drain every queued datagram, then go back to waiting
+        while True:
+            try:
+                data, address = self.sock.recvfrom(BUFFER_SIZE)
+            except (BlockingIOError, InterruptedError):
+                return
+            t = stats.clock()
+            try:
+                if protocol.is_binary(data):
+                    if DEBUG:
+                        print("Received {} binary bytes from '{}'".format(len(data), address))
+                    self.sock.sendto(self.process_binary(data, address), address)
+                    stats.record('udp.binary', stats.clock() - t)
+                elif len(data) > 0:
+                    self.process_text(data, address)
+                    stats.record('udp.text', stats.clock() - t)
+            except (ValueError, struct.error):
+                pass
+            except Exception as e:
+                # A command that fails must not take the receive thread, and every later client, down with it
+                print("Error handling datagram from '{}': {!r}".format(address, e))
 
     def receive_loop(self):
         if DEBUG:
             print("Server running in DEBUG")
-        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        selector = selectors.DefaultSelector()
+        selector.register(self.wake_recv, selectors.EVENT_READ)
+        if not self.done:
+            selector.register(self.sock, selectors.EVENT_READ)
+        while not self.done:
+            for key, events in selector.select():
+                if key.fileobj is self.sock:
+                    try:
+                        self.process_pending()
+                    except OSError as e:
+                        error_number = e.errno
+                        reason = get_error_name(error_number)
+                        print("Socket Error ({}): {}".format(error_number, reason))
+        selector.close()
+
+
+class SharedMemoryAPI:
+    # Serves the shared-memory transport: channel k of the segment drives robot k. Commands are run by a
+    # polling thread, and publish() copies the robots' state into the telemetry block after every step.
+    def __init__(self, execute, name=shmem.NAME, channels=shmem.CHANNELS):
+        self.done = False
+        self.execute = execute
+        self.name = name
+        self.segment = None
         try:
-            sock.bind(('127.0.0.1', 9080))
-            sock.setblocking(0)
-        except OSError as e:
-            self.done=True
-            print("Failed to bind socket")
-        send_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.segment = shmem.Segment.create(name, channels)
+        except (OSError, ValueError) as e:
+            self.done = True
+            print("Failed to create shared memory '{}': {}".format(name, e))
+            self.receive_thread = None
+            return
+        self.receive_thread = threading.Thread(target=self.receive_loop)
+        self.receive_thread.daemon = True
+        self.receive_thread.start()
+
+    def publish(self, world):
+        if self.segment:
+            self.segment.publish(world)
+
+    def shutdown(self):
+        self.done = True
+        if self.receive_thread:
+            self.receive_thread.join()
+            self.receive_thread = None
+        if self.segment:
+            self.segment.close(unlink=True)
+            self.segment = None
+
+    def process_pending(self):
+        segment = self.segment
+        busy = False
+        for channel in segment.pending():
+            # Only as many requests are taken as can be replied to; the rest wait until the controller has
+            # read its replies
+            room = segment.free(segment.replies, channel)
+            if room == 0:
+                continue
+            requests = segment.pop(segment.requests, channel, room)
+            busy = True
+            t = stats.clock()
+            replies = []
+            for request_id, opcode, args in requests:
+                values = None
+                try:
+                    if 0 < opcode < len(protocol.OPCODES):
+                        values = self.execute(protocol.OPCODES[opcode], args, channel)
+                    if values and len(values) > segment.max_values:
+                        raise ValueError('{} reply values do not fit a slot'.format(len(values)))
+                except Exception as e:
+                    # The request still gets its (empty) reply, so the controller is not left waiting
+                    print("Error handling shared-memory request on channel {}: {!r}".format(channel, e))
+                    values = None
+                replies.append((request_id, opcode, values or ()))
+            segment.push(segment.replies, channel, replies)
+            stats.record('shm', stats.clock() - t)
+        return busy
+
+    def receive_loop(self):
+        last = time.perf_counter()
         while not self.done:
-            try:
-                data, address = sock.recvfrom(256)
-                if len(data) == 0:
-                    time.sleep(0.01)
+            if self.process_pending():
+                last = time.perf_counter()
+            else:
+                idle = time.perf_counter() - last
+                if idle < SPIN_TIME:
+                    shmem.yield_cpu()
+                elif idle < IDLE_TIME:
+                    time.sleep(POLL_INTERVAL)
                 else:
-                    words = str(data,encoding='utf-8').strip().split()
-                    if DEBUG:
-                        print("Received from '{}' data='{}'".format(address, data))
-                    if len(words) < 1:
-                        continue
-                    try:
-                        cmd = words[0]
-                        args = [float(a) for a in words[1:]]
-                        response = self.callback(cmd, args)
-                        if response:
-                            if DEBUG:
-                                print("Sending response: '{}'".format(response))
-                            send_sock.sendto(bytes(response,'utf-8'),(address[0],9081))
-                    except ValueError:
-                        pass
-            except OSError as e:
-                error_number = e.errno
-                if error_number != errno.EAGAIN  and error_number != errno.EWOULDBLOCK:
-                    reason = get_error_name(error_number)
-                    print("Socket Error ({}): {}".format(error_number, reason))
-        sock.close()
-        send_sock.close()
+                    time.sleep(IDLE_INTERVAL)
@@ -0,0 +1,198 @@
+import os
+import time
+import platform
+from multiprocessing import shared_memory, resource_tracker
+import numpy as np
+
+# Shared-memory transport between a simulator and controllers on the same host. The simulator creates
+# a named segment holding, for each of `channels` robots, a request ring (controller -> simulator) and a
+# reply ring (simulator -> controller) of `slots` fixed-size records, plus a telemetry block with every
+# robot's state as of the last step.
+# Each ring has one writer and one reader, and each side only ever stores its own counter: a record is
+# filled in first and then published by advancing the write counter, so no locks are needed. The
+# telemetry block is a seqlock: the simulator makes the sequence odd while it writes and even when done,
+# and readers retry if it was odd or changed under them.
+# Counters are aligned 64-bit stores, and on x86 (total store order) a reader that sees a counter also
+# sees the record written before it. NumPy stores come with no memory barriers, so weaker orderings
+# (ARM, POWER) give no such guarantee, and segments are refused on anything but x86.
+MAGIC = 0x50525348
+VERSION = 1
+NAME = 'pyrobsim'
+CHANNELS = 16
+SLOTS = 16
+MAX_VALUES = 256
+# How long read_telemetry keeps retrying before it decides the simulator stopped mid-update
+TELEMETRY_TIMEOUT = 0.1
+HEADER = np.dtype([('magic', '<u4'), ('version', '<u4'), ('channels', '<u4'), ('slots', '<u4'),
+                   ('max_values', '<u4'), ('robots', '<u4'), ('sequence', '<u8')])
+# request_write, request_read, reply_write, reply_read
+COUNTERS = 4
+REQUEST_WRITE, REQUEST_READ, REPLY_WRITE, REPLY_READ = range(COUNTERS)
+# A ring slot is a row of float64: request id, opcode, value count, then the values
+SLOT_HEADER = 3
+X86_MACHINES = ('x86_64', 'amd64', 'i386', 'i486', 'i586', 'i686', 'x86')
+# Segments created by this process, which its resource tracker is responsible for
+created = set()
+TELEMETRY = np.dtype([('time', '<f8'), ('pose', '<f8', 3), ('velocity', '<f8', 2), ('clicks', '<i8', 2),
+                      ('sensor_angle', '<f8'), ('sensor', '<f8'), ('collided', '<u8')])
+
+
+# Pollers give up the CPU (and the GIL) between checks; time.sleep(0) would cost a timer wakeup
+if hasattr(os, 'sched_yield'):
+    yield_cpu = os.sched_yield
+else:
+    def yield_cpu():
+        time.sleep(0)
+
+
+def check_platform():
+    machine = platform.machine()
+    if machine.lower() not in X86_MACHINES:
+        raise OSError('the shared-memory transport needs x86 store ordering, not {}'.format(machine or 'unknown'))
+
+
+def segment_size(channels, slots, max_values):
+    return (HEADER.itemsize + channels * COUNTERS * 8 + 2 * channels * slots * (SLOT_HEADER + max_values) * 8 +
+            channels * TELEMETRY.itemsize)
+
+
+class Segment:
+    def __init__(self, shm):
+        self.shm = shm
+        buf = shm.buf
+        self.header = np.ndarray((), dtype=HEADER, buffer=buf)
+        if self.header['magic'] != MAGIC or self.header['version'] != VERSION:
+            self.header = None
+            raise IOError('{} is not a simulator segment'.format(shm.name))
+        self.channels = int(self.header['channels'])
+        self.slots = int(self.header['slots'])
+        self.max_values = int(self.header['max_values'])
+        shape = (self.channels, self.slots, SLOT_HEADER + self.max_values)
+        offset = HEADER.itemsize
+        self.counters = np.ndarray((self.channels, COUNTERS), dtype='<u8', buffer=buf, offset=offset)
+        offset += self.counters.nbytes
+        self.requests = np.ndarray(shape, dtype='<f8', buffer=buf, offset=offset)
+        offset += self.requests.nbytes
+        self.replies = np.ndarray(shape, dtype='<f8', buffer=buf, offset=offset)
+        offset += self.replies.nbytes
+        self.telemetry = np.ndarray(self.channels, dtype=TELEMETRY, buffer=buf, offset=offset)
+
+    @classmethod
+    def create(cls, name=NAME, channels=CHANNELS, slots=SLOTS, max_values=MAX_VALUES):
+        check_platform()
+        shm = shared_memory.SharedMemory(name, create=True, size=segment_size(channels, slots, max_values))
+        header = np.ndarray((), dtype=HEADER, buffer=shm.buf)
+        header[()] = (MAGIC, VERSION, channels, slots, max_values, 0, 0)
+        del header
+        created.add(shm.name)
+        return cls(shm)
+
+    @classmethod
+    def attach(cls, name=NAME):
+        check_platform()
+        shm = shared_memory.SharedMemory(name)
+        # Only the creator may unlink the segment, but the resource tracker would do it when this process exits
+        if shm.name not in created:
+            resource_tracker.unregister(shm._name, 'shared_memory')
+        try:
+            return cls(shm)
+        except IOError:
+            shm.close()
+            raise
+
+    def ring_counters(self, ring):
+        if ring is self.requests:
+            return REQUEST_WRITE, REQUEST_READ
+        return REPLY_WRITE, REPLY_READ
+
+    def free(self, ring, channel):
+        # Records that can be pushed onto a ring before its reader takes any off
+        write_index, read_index = self.ring_counters(ring)
+        counters = self.counters[channel]
+        return self.slots - (counters.item(write_index) - counters.item(read_index))
+
+    def push(self, ring, channel, records):
+        # Appends (request_id, opcode, values) records to a ring and publishes them with a single counter
+        # store. Nothing is written unless all of them fit: IOError if the ring lacks room for them,
+        # ValueError if one has more than max_values values.
+        if len(records) > self.free(ring, channel):
+            raise IOError('{} records do not fit the {} free slots of channel {}'.format(
+                len(records), self.free(ring, channel), channel))
+        for request_id, opcode, values in records:
+            if len(values) > self.max_values:
+                raise ValueError('{} values do not fit a slot of {}'.format(len(values), self.max_values))
+        write_index, read_index = self.ring_counters(ring)
+        counters = self.counters[channel]
+        write = counters.item(write_index)
+        for request_id, opcode, values in records:
+            n = len(values)
+            ring[channel, write % self.slots, :SLOT_HEADER + n] = [request_id, opcode, n] + list(values)
+            write += 1
+        counters[write_index] = write
+
+    def pop(self, ring, channel, limit=None):
+        # Takes the published records off a ring, at most limit of them
+        write_index, read_index = self.ring_counters(ring)
+        counters = self.counters[channel]
+        read = counters.item(read_index)
+        write = counters.item(write_index)
+        if limit is not None:
+            write = min(write, read + limit)
+        records = []
+        while read < write:
+            slot = ring[channel, read % self.slots]
+            request_id, opcode, n = slot[:SLOT_HEADER].tolist()
+            records.append((int(request_id), int(opcode), slot[SLOT_HEADER:SLOT_HEADER + int(n)].tolist()))
+            read += 1
+        counters[read_index] = read
+        return records
+
+    def pending(self):
+        # Channels with requests waiting, in one vectorized check
+        return np.nonzero(self.counters[:, REQUEST_WRITE] != self.counters[:, REQUEST_READ])[0].tolist()
+
+    def publish(self, world):
+        n = min(len(world.robots), self.channels)
+        header = self.header
+        header['sequence'] += 1
+        telemetry = self.telemetry
+        telemetry['time'][:n] = world.time
+        telemetry['pose'][:n] = world.pose[:n]
+        telemetry['velocity'][:n] = world.velocity[:n]
+        telemetry['clicks'][:n] = world.clicks[:n]
+        telemetry['sensor_angle'][:n] = world.sensor_angle[:n]
+        telemetry['sensor'][:n] = world.sensor_value[:n]
+        telemetry['collided'][:n] = world.collided[:n]
+        header['robots'] = n
+        header['sequence'] += 1
+
+    def read_telemetry(self, channel, timeout=TELEMETRY_TIMEOUT):
+        # Consistent copy of one robot's telemetry record, or None if it has none. A write takes
+        # microseconds, so if none could be read within timeout the simulator stopped in the middle of
+        # one, and IOError is raised rather than waiting forever.
+        header = self.header
+        deadline = None
+        while True:
+            sequence = int(header['sequence'])
+            if not sequence & 1:
+                if channel >= header['robots']:
+                    return None
+                record = self.telemetry[channel].copy()
+                if int(header['sequence']) == sequence:
+                    return record
+            if deadline is None:
+                deadline = time.perf_counter() + timeout
+            elif time.perf_counter() > deadline:
+                raise IOError('telemetry of {} is stuck mid-update'.format(self.shm.name))
+            yield_cpu()
+
+    def close(self, unlink=False):
+        if self.shm is None:
+            return
+        # numpy views on the buffer must go before the segment can be closed
+        self.header = self.counters = self.requests = self.replies = self.telemetry = None
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+            created.discard(self.shm.name)
+        self.shm = None
@@ -0,0 +1,109 @@
+import math
+import numpy as np
+from geometry import Edges
+
+INF = float('inf')
+EMPTY = np.zeros(0, dtype=np.int64)
+
+
+class Grid:
+    # Uniform grid over polygons given as an (n, k, 2) corner array and their (n * k, 7) edge table. Each
+    # cell lists the polygons whose bounding box overlaps it. Building is vectorised: every (cell, polygon)
+    # entry is generated at once and sorted by cell, and a cell's list is a slice of that order.
+    def __init__(self, corners, table, cell_size=0.0):
+        n = len(corners)
+        self.polys = table.reshape(n, corners.shape[1], 7)
+        lo = corners.min(axis=1)
+        hi = corners.max(axis=1)
+        if cell_size <= 0.0:
+            cell_size = 100.0
+            if n:
+                cell_size = max(2.0 * float((hi - lo).max(axis=1).mean()), 10.0)
+        self.cell_size = cell_size
+        i0 = np.floor(lo / cell_size).astype(np.int64)
+        span = np.floor(hi / cell_size).astype(np.int64) - i0 + 1
+        counts = span[:, 0] * span[:, 1]
+        owner = np.repeat(np.arange(n), counts)
+        k = np.arange(len(owner)) - np.repeat(np.cumsum(counts) - counts, counts)
+        i = i0[owner, 0] + k % span[owner, 0]
+        j = i0[owner, 1] + k // span[owner, 0]
+        # Cells are numbered (i - imin) * rows + (j - jmin) over the bounding range of occupied cells
+        self.imin = int(i.min()) if n else 0
+        self.jmin = int(j.min()) if n else 0
+        self.columns = int(i.max()) - self.imin + 1 if n else 0
+        self.rows = int(j.max()) - self.jmin + 1 if n else 0
+        codes = (i - self.imin) * self.rows + (j - self.jmin)
+        order = np.argsort(codes, kind='stable')
+        self.codes = codes[order]
+        self.members = owner[order]
+        # Per-cell edge tables are gathered on first use, so building a large grid stays cheap
+        self.cell_edges = {}
+
+    def cell_range(self, xmin, ymin, xmax, ymax):
+        cs = self.cell_size
+        return (int(math.floor(xmin / cs)), int(math.floor(ymin / cs)),
+                int(math.floor(xmax / cs)), int(math.floor(ymax / cs)))
+
+    def cell(self, i, j):
+        # Ids of the polygons listed in cell (i, j), in ascending order
+        i -= self.imin
+        j -= self.jmin
+        if i < 0 or j < 0 or i >= self.columns or j >= self.rows:
+            return EMPTY
+        code = i * self.rows + j
+        return self.members[self.codes.searchsorted(code):self.codes.searchsorted(code, 'right')]
+
+    def edges(self, ids):
+        return Edges(self.polys[ids].reshape(-1, 7))
+
+    def edges_at(self, key):
+        # Edge table of the polygons in a cell, or None for an empty one
+        if key in self.cell_edges:
+            return self.cell_edges[key]
+        ids = self.cell(*key)
+        edges = self.cell_edges[key] = self.edges(ids) if len(ids) else None
+        return edges
+
+    def query(self, xmin, ymin, xmax, ymax):
+        # Ids of the polygons listed in any cell the box overlaps, each once
+        i0, j0, i1, j1 = self.cell_range(xmin, ymin, xmax, ymax)
+        if i0 == i1 and j0 == j1:
+            return self.cell(i0, j0)
+        return np.unique(np.concatenate([self.cell(i, j) for i in range(i0, i1 + 1) for j in range(j0, j1 + 1)]))
+
+    def query_edges(self, xmin, ymin, xmax, ymax):
+        i0, j0, i1, j1 = self.cell_range(xmin, ymin, xmax, ymax)
+        result = []
+        for i in range(i0, i1 + 1):
+            for j in range(j0, j1 + 1):
+                edges = self.edges_at((i, j))
+                if edges is not None:
+                    result.append(edges)
+        return result
+
+    def ray_cells(self, start, direction, length):
+        # Amanatides-Woo traversal: yields (t_exit, edges) for each cell the ray crosses, in order
+        cs = self.cell_size
+        x = start.x / cs
+        y = start.y / cs
+        i = int(math.floor(x))
+        j = int(math.floor(y))
+        dx = direction.x
+        dy = direction.y
+        step_i = 1 if dx > 0 else -1
+        step_j = 1 if dy > 0 else -1
+        t_max_x = ((i + (dx > 0)) - x) * cs / dx if dx != 0 else INF
+        t_max_y = ((j + (dy > 0)) - y) * cs / dy if dy != 0 else INF
+        t_delta_x = cs / abs(dx) if dx != 0 else INF
+        t_delta_y = cs / abs(dy) if dy != 0 else INF
+        while True:
+            t_exit = min(t_max_x, t_max_y)
+            yield t_exit, self.edges_at((i, j))
+            if t_exit >= length:
+                return
+            if t_max_x < t_max_y:
+                i += step_i
+                t_max_x += t_delta_x
+            else:
+                j += step_j
+                t_max_y += t_delta_y
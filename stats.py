@@ -0,0 +1,124 @@
+import sys
+import math
+import json
+import time
+import threading
+
+# Per-phase timing kept in process: every phase remembers its call count, total time and a ring of the
+# last WINDOW durations, from which percentiles and a log2 histogram are computed on demand.
+# Callers time a phase with t = stats.clock() ... stats.record(name, stats.clock() - t).
+# The simulation, UDP and shared-memory threads all record, so every access goes through lock.
+WINDOW = 1024
+enabled = True
+clock = time.perf_counter
+phases = {}
+started = time.time()
+lock = threading.Lock()
+
+
+class Phase:
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.samples = [0.0] * WINDOW
+
+    def add(self, seconds):
+        self.samples[self.count % WINDOW] = seconds
+        self.count += 1
+        self.total += seconds
+
+    def copy(self):
+        phase = Phase()
+        phase.count = self.count
+        phase.total = self.total
+        phase.samples = self.samples[:]
+        return phase
+
+    def summary(self):
+        n = min(self.count, WINDOW)
+        window = sorted(self.samples[:n])
+        result = {'count': self.count, 'total_ms': round(self.total * 1e3, 3)}
+        if n == 0:
+            return result
+        result['mean_us'] = round(sum(window) / n * 1e6, 3)
+        for name, q in (('p50_us', 0.5), ('p90_us', 0.9), ('p99_us', 0.99)):
+            result[name] = round(window[min(n - 1, int(q * n))] * 1e6, 3)
+        result['max_us'] = round(window[-1] * 1e6, 3)
+        # Bucket k counts samples below 2**k microseconds (and at or above 2**(k-1))
+        histogram = {}
+        for s in window:
+            us = s * 1e6
+            k = math.frexp(us)[1] if us >= 1.0 else 0
+            histogram[k] = histogram.get(k, 0) + 1
+        result['histogram'] = [[2 ** k, histogram[k]] for k in sorted(histogram)]
+        return result
+
+
+def record(name, seconds):
+    if not enabled:
+        return
+    with lock:
+        phase = phases.get(name)
+        if phase is None:
+            phase = phases[name] = Phase()
+        phase.add(seconds)
+
+
+def reset():
+    global started
+    with lock:
+        phases.clear()
+        started = time.time()
+
+
+def summary():
+    # The phases are copied under the lock and summarized outside it, so recording threads barely wait
+    with lock:
+        uptime = time.time() - started
+        current = dict((name, phase.copy()) for name, phase in phases.items())
+    return {'uptime_s': round(uptime, 3),
+            'phases': dict((name, current[name].summary()) for name in sorted(current))}
+
+
+def to_json():
+    return json.dumps(summary(), separators=(',', ':'))
+
+
+def report():
+    lines = ['{:<16} {:>9} {:>11} {:>9} {:>9} {:>9} {:>9}'.format(
+        'phase', 'count', 'total ms', 'mean us', 'p50 us', 'p99 us', 'max us')]
+    for name, s in summary()['phases'].items():
+        if s['count'] == 0:
+            continue
+        lines.append('{:<16} {:>9} {:>11.1f} {:>9.1f} {:>9.1f} {:>9.1f} {:>9.1f}'.format(
+            name, s['count'], s['total_ms'], s['mean_us'], s['p50_us'], s['p99_us'], s['max_us']))
+    return '\n'.join(lines)
+
+
+class Dumper(threading.Thread):
+    # Writes report() to f every period seconds until stopped
+    def __init__(self, period, f=None):
+        super(Dumper, self).__init__()
+        self.daemon = True
+        self.period = period
+        self.f = f or sys.stderr
+        self.wake = threading.Event()
+
+    def run(self):
+        while not self.wake.wait(self.period):
+            self.dump()
+
+    def dump(self):
+        self.f.write('--- stats after {:.1f} s\n{}\n'.format(time.time() - started, report()))
+        self.f.flush()
+
+    def stop(self):
+        self.wake.set()
+        if self.is_alive():
+            self.join()
+
+
+def start_dump(period, f=None):
+    dumper = Dumper(period, f)
+    dumper.start()
+    return dumper
@@ -0,0 +1,30 @@
+import os
+import numpy as np
+import scenefile
+
+
+def write(path, text, mtime):
+    with open(path, 'w') as f:
+        f.write(text)
+    os.utime(path, (mtime, mtime))
+
+
+def test_compiled_scene_is_rebuilt_when_text_changes(tmp_path):
+    path = str(tmp_path / 'test.scene')
+    write(path, '100 100 50 50 0\n10 10 0\n', 1000000000.0)
+    obstacles, corners, lines, poses = scenefile.load_scene(path)
+    assert obstacles.tolist() == [[100, 100, 50, 50, 0]]
+    assert os.path.exists(path + scenefile.CACHE_SUFFIX)
+    assert scenefile.map_scene(path + scenefile.CACHE_SUFFIX, path) is not None
+    # Same size, new mtime
+    write(path, '200 100 50 50 0\n10 10 0\n', 1000000001.0)
+    assert scenefile.map_scene(path + scenefile.CACHE_SUFFIX, path) is None
+    assert scenefile.load_scene(path)[0].tolist() == [[200, 100, 50, 50, 0]]
+    # New size, same mtime
+    write(path, '200 100 50 50 0\n300 100 50 50 0\n10 10 0\n', 1000000001.0)
+    obstacles, corners, lines, poses = scenefile.load_scene(path)
+    assert obstacles.tolist() == [[200, 100, 50, 50, 0], [300, 100, 50, 50, 0]]
+    assert corners.shape == (2, 4, 2)
+    assert poses.tolist() == [[10, 10, 0]]
+    # Unchanged text is mapped from the cache
+    assert isinstance(scenefile.load_scene(path)[0].base, np.memmap)
@@ -0,0 +1,175 @@
+import os
+import time
+import shutil
+import platform
+import numpy as np
+import pytest
+from world import World
+import protocol
+import rclient
+import server
+import shmem
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+x86_only = pytest.mark.skipif(platform.machine().lower() not in shmem.X86_MACHINES,
+                              reason='the shared-memory transport needs x86')
+
+
+@pytest.fixture
+def world(tmp_path):
+    path = str(tmp_path / 'smallmaze.scene')
+    shutil.copy(os.path.join(HERE, 'smallmaze.scene'), path)
+    world = World()
+    world.load_scene(path)
+    return world
+
+
+@pytest.fixture
+def api(world):
+    api = server.API(world.process_command, world.execute, port=0, robots=lambda: len(world.robots))
+    yield api
+    api.shutdown()
+
+
+def test_protocol_pack_round_trip():
+    records = [(1, 0, protocol.OPCODE['V'], (10.0, -20.5)), (2, 3, protocol.OPCODE['S'], ()),
+               (0xFFFFFFFF, 65535, protocol.OPCODE['SCANA'], tuple(float(a) for a in range(-45, 46)))]
+    data = protocol.pack(records)
+    assert protocol.is_binary(data)
+    assert protocol.unpack(data) == records
+
+
+def test_binary_udp_round_trip(world, api):
+    client = rclient.Robot('127.0.0.1', binary=True, port=api.port)
+    try:
+        client.sensor_angle(-30)
+        assert client.sense() == pytest.approx(world.robot.sense(), abs=1e-6)
+        scan = client.scan(-45, 45, 5)
+        assert scan == pytest.approx(world.robot.scan(np.linspace(-45, 45, 5)).tolist(), abs=1e-6)
+        assert client.sim_time() == pytest.approx(world.time)
+    finally:
+        client.shutdown()
+    assert api.receive_thread.is_alive()
+
+
+def test_text_udp_round_trip(world, api):
+    client = rclient.Robot('127.0.0.1', port=api.port)
+    try:
+        client.sensor_angle(-30)
+        assert client.sense() == pytest.approx(world.robot.sense(), abs=1e-6)
+        scan = client.scan(-45, 45, 5)
+        assert scan == pytest.approx(world.robot.scan(np.linspace(-45, 45, 5)).tolist(), abs=1e-6)
+        assert client.sim_time() == pytest.approx(world.time)
+    finally:
+        client.shutdown()
+    assert api.receive_thread.is_alive()
+
+
+def test_sessions_are_allocated_and_refused(world, api):
+    world.add_robot(400, 600, 0)
+    clients = []
+    try:
+        a = rclient.Robot('127.0.0.1', port=api.port, session=True)
+        clients.append(a)
+        b = rclient.Robot('127.0.0.1', binary=True, port=api.port, session=True)
+        clients.append(b)
+        assert (a.impl.robot, b.impl.robot) == (0, 1)
+        assert a.impl.session != b.impl.session
+        # Both robots are taken, whether any or a particular one is asked for
+        with pytest.raises(IOError):
+            rclient.Robot('127.0.0.1', port=api.port, session=True)
+        with pytest.raises(IOError):
+            rclient.Robot('127.0.0.1', 1, binary=True, port=api.port, session=True)
+        # Each session drives its own robot
+        a.drive(100, 50)
+        b.drive(-20, 30)
+        assert a.sim_time() == b.sim_time() == 0.0
+        assert world.velocity.tolist() == [[100, 50], [-20, 30]]
+        # Clients without a session cannot drive a claimed robot
+        for binary in (False, True):
+            for robot in (0, 1):
+                c = rclient.Robot('127.0.0.1', robot, binary=binary, port=api.port)
+                c.drive(250, 250)
+                assert c.sense() == -1.0
+                c.shutdown()
+        assert world.velocity.tolist() == [[100, 50], [-20, 30]]
+        # BYE frees the robot for the next client
+        a.shutdown()
+        clients.remove(a)
+        c = rclient.Robot('127.0.0.1', binary=True, port=api.port, session=True)
+        clients.append(c)
+        assert c.impl.robot == 0
+    finally:
+        for client in clients:
+            client.shutdown()
+
+
+def wait_until(condition, timeout=2.0):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline
+        time.sleep(0.001)
+
+
+@x86_only
+def test_shared_memory_round_trip(world):
+    name = 'pyrobsim-test-{}'.format(os.getpid())
+    api = server.SharedMemoryAPI(world.execute, name)
+    client = None
+    try:
+        assert not api.done
+        world.telemetry = api
+        client = rclient.Robot('shm:' + name, 0)
+        assert client.telemetry() is None
+        client.sensor_angle(-30)
+        assert client.sense() == pytest.approx(world.robot.sense(), abs=1e-6)
+        scan = client.scan(-45, 45, 5)
+        assert scan == pytest.approx(world.robot.scan(np.linspace(-45, 45, 5)).tolist(), abs=1e-6)
+        # More commands than the rings have slots go out in several batches
+        replies = client.impl.exchange([('T', [])] * (3 * shmem.SLOTS + 1))
+        assert replies == [[0.0]] * (3 * shmem.SLOTS + 1)
+        client.drive(100, 50)
+        world.advance(0.01)
+        telemetry = client.telemetry()
+        assert telemetry['time'] == pytest.approx(0.01)
+        assert telemetry['pose'] == tuple(world.pose[0].tolist())
+        assert telemetry['velocity'] == (100.0, 50.0)
+        # With its reply ring full the server leaves requests queued rather than dropping their replies
+        segment = client.impl.segment
+        slots = segment.slots
+        segment.push(segment.requests, 0, [(1000 + k, protocol.OPCODE['T'], []) for k in range(slots)])
+        wait_until(lambda: segment.free(segment.replies, 0) == 0)
+        segment.push(segment.requests, 0, [(2000 + k, protocol.OPCODE['T'], []) for k in range(slots)])
+        time.sleep(0.05)
+        assert segment.pending() == [0]
+        ids = [r[0] for r in segment.pop(segment.replies, 0)]
+        wait_until(lambda: segment.free(segment.replies, 0) == 0)
+        ids += [r[0] for r in segment.pop(segment.replies, 0)]
+        assert ids == list(range(1000, 1000 + slots)) + list(range(2000, 2000 + slots))
+    finally:
+        if client:
+            client.shutdown()
+        api.shutdown()
+
+
+@x86_only
+def test_shared_memory_ring_refuses_what_does_not_fit():
+    segment = shmem.Segment.create('pyrobsim-test-ring-{}'.format(os.getpid()), channels=1, slots=4, max_values=8)
+    try:
+        ring = segment.requests
+        segment.push(ring, 0, [(k, 1, [float(k)]) for k in range(3)])
+        assert segment.free(ring, 0) == 1
+        # Nothing is written unless every record fits
+        with pytest.raises(IOError):
+            segment.push(ring, 0, [(3, 1, []), (4, 1, [])])
+        with pytest.raises(ValueError):
+            segment.push(ring, 0, [(3, 1, [0.0] * 9)])
+        assert segment.free(ring, 0) == 1
+        assert segment.pending() == [0]
+        assert segment.pop(ring, 0, 2) == [(0, 1, [0.0]), (1, 1, [1.0])]
+        segment.push(ring, 0, [(3, 2, [0.0] * 8), (4, 2, [])])
+        assert segment.free(ring, 0) == 1
+        assert segment.pop(ring, 0) == [(2, 1, [2.0]), (3, 2, [0.0] * 8), (4, 2, [])]
+        assert segment.pending() == []
+    finally:
+        segment.close(unlink=True)
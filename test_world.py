@@ -0,0 +1,288 @@
+import os
+import math
+import shutil
+import numpy as np
+import pytest
+from world import World, SENSOR_RANGE, MAX_SCAN_RAYS
+from geometry import Edges, sat_pairs, ray_intersection, build_edge_table
+import distfield
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def write_scene(tmp_path, lines):
+    path = str(tmp_path / 'test.scene')
+    with open(path, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+    return path
+
+
+def copy_scene(tmp_path, name):
+    path = str(tmp_path / name)
+    shutil.copy(os.path.join(HERE, name), path)
+    return path
+
+
+def brute_sense(world, robot):
+    # Exact reading against every obstacle edge at once, without the grid or the field
+    edges = Edges(build_edge_table(np.asarray(world.obstacle_corners, dtype=float)))
+    d = ray_intersection(robot.get_sensor_position(), robot.get_sensor_direction(), SENSOR_RANGE, edges)
+    return d if d >= 0 else -1.0
+
+
+def free_poses(world, count, seed=0):
+    rng = np.random.default_rng(seed)
+    corners = world.obstacle_corners.reshape(-1, 2)
+    lo = corners.min(axis=0)
+    hi = corners.max(axis=0)
+    robot = world.robot
+    poses = []
+    while len(poses) < count:
+        x, y = rng.uniform(lo, hi)
+        robot.set_pos(x, y)
+        robot.set_angle(rng.uniform(0, 360))
+        if world.find_contacts(np.array([0]))[0] == 0:
+            poses.append((x, y, robot.angle, rng.uniform(-45, 45)))
+    return poses
+
+
+def test_sweep_stops_at_thin_wall_with_large_step(tmp_path):
+    # A 2-unit wall 169 units ahead of the robot's front; one 1 s step at 250 units/s would jump clean over it
+    world = World()
+    world.load_scene(write_scene(tmp_path, ['200 200 400 2 0', '200 400 0']))
+    robot = world.robot
+    robot.velocity = (250, 250)
+    world.advance(1.0)
+    assert robot.collided
+    assert robot.collision_time == pytest.approx(169.0 / 250.0, abs=1e-3)
+    assert robot.pos.y > 230.0
+
+
+def stepped_clicks(velocity, dt, steps):
+    # Encoder clicks as the original Robot.advance counted them, integrating in 1 ms sub-steps
+    encoders = [0.0, 0.0]
+    clicks = [0, 0]
+    result = []
+    for _ in range(steps):
+        start = [math.floor(e) for e in encoders]
+        remaining = dt
+        while remaining > 0:
+            h = min(0.001, remaining)
+            remaining -= h
+            encoders = [encoders[0] + h * velocity[0], encoders[1] + h * velocity[1]]
+        clicks = [clicks[k] + math.floor(encoders[k]) - start[k] for k in range(2)]
+        result.append(clicks)
+    return result
+
+
+@pytest.mark.parametrize('dt', [0.01, 0.05, 0.1])
+@pytest.mark.parametrize('velocity', [(83.7, 51.3), (-37.1, 78.9), (213.3, -4.7), (250.0, -250.0)])
+def test_encoder_clicks_match_millisecond_stepper(velocity, dt):
+    world = World()
+    world.robot.velocity = velocity
+    for k, expected in enumerate(stepped_clicks(velocity, dt, 200)):
+        world.advance_robots(dt)
+        # Where a wheel ends a step exactly on a click, rounding in the sum of sub-steps decides the count
+        travelled = [(k + 1) * dt * v for v in velocity]
+        if all(abs(t - round(t)) > 1e-6 for t in travelled):
+            assert world.clicks[0].tolist() == expected
+
+
+def test_scan_matches_brute_force(tmp_path):
+    world = World()
+    world.load_scene(copy_scene(tmp_path, 'smallmaze.scene'))
+    robot = world.robot
+    angles = np.linspace(-45, 45, 7)
+    for x, y, a, sensor_angle in free_poses(world, 40):
+        robot.set_pos(x, y)
+        robot.set_angle(a)
+        scan = robot.scan(angles)
+        for angle, reading in zip(angles.tolist(), scan.tolist()):
+            robot.set_sensor_angle(angle)
+            assert reading == pytest.approx(brute_sense(world, robot), abs=1e-6)
+
+
+def test_scan_rejects_bad_arguments():
+    robot = World().robot
+    assert len(robot.execute('SCAN', [-45, 45, MAX_SCAN_RAYS])) == MAX_SCAN_RAYS
+    for args in ([-45, 45, MAX_SCAN_RAYS + 1], [-45, 45, 0], [0, 1, math.inf], [math.nan, 45, 5], [-45, 45]):
+        assert robot.execute('SCAN', args) is None
+    assert robot.execute('SCANA', [0.0] * (MAX_SCAN_RAYS + 1)) is None
+    assert robot.execute('SCANA', [0.0, math.inf]) is None
+
+
+def test_single_robot_path_matches_batch_path():
+    # advance_robots() steps a lone robot on plain floats; it must agree bit for bit with the array code
+    rng = np.random.default_rng(2)
+    single = World()
+    batch = World()
+    batch.add_robot(150, 150, 0)
+    for _ in range(300):
+        velocity = rng.uniform(-250, 250, 2)
+        if rng.random() < 0.2:
+            velocity[1] = velocity[0]
+        dt = rng.choice([0.001, 0.01, 0.1, 1.0])
+        single.velocity[0] = velocity
+        batch.velocity[:] = velocity
+        single.advance_robots(dt)
+        batch.advance_robots(dt)
+        for name in ('pose', 'encoders', 'clicks', 'distance', 'corners'):
+            assert getattr(single, name)[0].tolist() == getattr(batch, name)[0].tolist()
+        assert single.robot_edges.tolist() == batch.robot_edges[:4].tolist()
+
+
+def test_batch_seeds_give_distinct_episodes(tmp_path):
+    import batch
+    scene = copy_scene(tmp_path, 'box.scene')
+    rows = [batch.run_episode(scene, 'simrobot', seed, 2.0) for seed in (0, 1, 2, 0)]
+    assert len(set((r['x'], r['y'], r['angle']) for r in rows)) == 3
+    assert rows[0] == dict(rows[3], wall_time=rows[0]['wall_time'])
+
+
+def test_trajectory_does_not_depend_on_clock_speed(tmp_path):
+    import headless
+    import rclient
+    scene = copy_scene(tmp_path, 'smallmaze.scene')
+    finals = []
+    for speed in (0.0, 1.0, 40.0):
+        world = World()
+        world.clock.set_speed(speed)
+        world.load_scene(scene)
+        rclient.simhook = world.robots
+        headless.run(world, headless.load_controller('simrobot', fresh=True), 0.5, 0.01)
+        finals.append((world.time, world.pose.tolist(), world.clicks.tolist(), world.sensor_value.tolist()))
+    assert finals[0][1] != [[250.0, 600.0, 0.0]]
+    assert finals[1] == finals[0]
+    assert finals[2] == finals[0]
+
+
+def test_snapshot_restore_gives_identical_continuations(tmp_path):
+    import headless
+    import rclient
+    world = World()
+    world.load_scene(copy_scene(tmp_path, 'smallmaze.scene'))
+    rclient.simhook = world.robots
+    controller = headless.load_controller('simrobot', fresh=True)
+    robot = world.robot
+
+    def play(steps):
+        trace = []
+        for _ in range(steps):
+            controller.run()
+            world.advance(0.01)
+            trace.append((world.time, world.pose.tolist(), world.clicks.tolist(), world.sensor_value.tolist()))
+        return trace
+
+    play(50)
+    snapshot_id = robot.execute('SNAP', [])[0]
+    first = play(200)
+    assert robot.execute('RESTORE', [snapshot_id]) == [1]
+    assert play(200) == first
+    assert robot.execute('RESTORE', [snapshot_id]) == [1]
+    assert play(200) == first
+    robot.execute('DROP', [snapshot_id, math.inf])
+    assert robot.execute('RESTORE', [snapshot_id]) == [0]
+    assert robot.execute('RESTORE', [math.nan]) is None
+
+
+@pytest.mark.parametrize('dt', [0.01, 0.1, 1.0])
+def test_swept_contact_depth_does_not_depend_on_step(tmp_path, dt):
+    world = World()
+    world.load_scene(write_scene(tmp_path, ['200 200 400 2 0', '200 400 0']))
+    robot = world.robot
+    robot.velocity = (250, 250)
+    while not robot.collided:
+        world.advance(dt)
+    assert robot.collision_time == pytest.approx(169.0 / 250.0, abs=1e-4)
+    assert 0 < robot.penetration < 1e-3
+    assert world.find_contacts(np.array([0]))[0] == 0
+
+
+def test_sat_detects_polygon_inside_another(tmp_path):
+    small = np.array([[(-1.0, -1.0), (1.0, -1.0), (1.0, 1.0), (-1.0, 1.0)]])
+    big = 10 * small
+    t1 = build_edge_table(small).reshape(1, 4, 7)
+    t2 = build_edge_table(big).reshape(1, 4, 7)
+    assert sat_pairs(t1, t2)[0] > 0
+    assert sat_pairs(t2, t1)[0] > 0
+    apart = build_edge_table(small + 5).reshape(1, 4, 7)
+    assert sat_pairs(t1, apart)[0] <= 0
+    # A robot placed entirely inside an obstacle touches none of its sides, but is still in contact
+    world = World()
+    world.load_scene(write_scene(tmp_path, ['500 500 400 400 0', '500 500 0']))
+    world.check_intersections()
+    assert world.robot.collided
+    assert world.robot.penetration > 0
+
+
+def test_sensor_and_contacts_match_brute_force_with_field(tmp_path):
+    world = World()
+    world.load_scene(copy_scene(tmp_path, 'smallmaze.scene'))
+    robot = world.robot
+    poses = free_poses(world, 40)
+    for resolution in (0.0, 5.0, 2.0):
+        world.set_field_resolution(resolution)
+        for x, y, a, sensor_angle in poses:
+            robot.set_pos(x, y)
+            robot.set_angle(a)
+            robot.set_sensor_angle(sensor_angle)
+            assert robot.sense() == pytest.approx(brute_sense(world, robot), abs=1e-6)
+            assert world.find_contacts(np.array([0]))[0] == 0
+    # Culling through the field must keep every real contact
+    rng = np.random.default_rng(3)
+    corners = world.obstacle_corners.reshape(-1, 2)
+    poses = [(x, y, a) for (x, y), a in zip(rng.uniform(corners.min(axis=0), corners.max(axis=0), (300, 2)).tolist(),
+                                            rng.uniform(0, 360, 300).tolist())]
+    depths = []
+    for resolution in (0.0, 2.0):
+        world.set_field_resolution(resolution)
+        depths.append([])
+        for x, y, a in poses:
+            robot.set_pos(x, y)
+            robot.set_angle(a)
+            depths[-1].append(world.find_contacts(np.array([0]))[0])
+    assert any(depths[0])
+    assert depths[1] == depths[0]
+
+
+def test_field_distance_is_a_lower_bound(tmp_path):
+    world = World()
+    world.load_scene(copy_scene(tmp_path, 'smallmaze.scene'))
+    corners = world.obstacle_corners
+    rng = np.random.default_rng(1)
+    lo = corners.reshape(-1, 2).min(axis=0) - 100
+    hi = corners.reshape(-1, 2).max(axis=0) + 100
+    points = rng.uniform(lo, hi, (500, 2))
+    exact = distfield.rect_distance(points, corners)
+    for resolution in (2.0, 5.0, 13.0):
+        field = distfield.build_field(corners, resolution)
+        assert (field.safe_distance(points) <= exact + 1e-9).all()
+        assert all(field.safe_distance_at(x, y) <= d + 1e-9 for (x, y), d in zip(points.tolist(), exact.tolist()))
+
+
+def test_sensor_cache_invalidation(tmp_path):
+    world = World()
+    wall = write_scene(tmp_path, ['200 200 400 2 0', '200 300 0'])
+    world.load_scene(wall)
+    robot = world.robot
+    first = robot.sense()
+    assert first == pytest.approx(brute_sense(world, robot))
+    assert robot.sense() == first
+    assert (robot.sensor_calls, robot.sensor_hits, robot.sensor_misses) == (2, 1, 1)
+    # Moving, by hand or by stepping, misses
+    robot.set_pos(200, 280)
+    assert robot.sense() == pytest.approx(first - 20)
+    robot.velocity = (50, 50)
+    world.advance(0.1)
+    assert robot.sense() == pytest.approx(first - 25)
+    assert robot.sensor_hits == 1
+    # Restarting puts the robot back where the first reading was taken
+    world.restart()
+    assert robot.sense() == first
+    assert robot.sensor_calls == 1
+    # Reloading changes the obstacles under an unchanged pose (the new text differs in size, so that the
+    # compiled cache is rebuilt even where the mtime has not moved)
+    open(wall, 'w').write('200 250 400 2.0 0\n200 300 0\n')
+    world.load_scene(wall)
+    assert robot.sense() == pytest.approx(first - 50)
+    assert robot.sense() == pytest.approx(brute_sense(world, robot))
@@ -1,15 +1,6 @@
 import math
-from PyQt5 import QtGui,QtCore
 
 
-def matrix(angle):
-    mat=QtGui.QTransform()
-    mat.rotate(angle)
-    return mat
-
-def pt(x,y):
-    return QtCore.QPointF(x,y)
-
 class vec2:
     def __init__(self,*args):
         self.x=0.0
@@ -19,8 +10,12 @@ class vec2:
             self.y=args[1]
         elif len(args)==1:
             p=args[0]
-            self.x = p.x()
-            self.y = p.y()
+            if isinstance(p,(tuple,list)):
+                self.x = p[0]
+                self.y = p[1]
+            else:
+                self.x = p.x()
+                self.y = p.y()
 
     def __iadd__(self, other):
         self.x += other.x
@@ -33,11 +28,17 @@ class vec2:
     def __add__(self, other):
         return vec2(self.x + other.x, self.y + other.y)
 
+    def __neg__(self):
+        return vec2(-self.x,-self.y)
+
     def __mul__(self, other):
         if isinstance(other,vec2):
             return self.x*other.x+self.y*other.y
         return vec2(self.x*other,self.y*other)
 
+    def __rmul__(self, other):
+        return vec2(self.x*other,self.y*other)
+
     def __truediv__(self, other):
         return vec2(self.x/other,self.y/other)
 
@@ -51,6 +52,9 @@ class vec2:
             return self.y
         return 0.0
 
+    def __repr__(self):
+        return 'vec2({}, {})'.format(self.x,self.y)
+
     def norm(self):
         return math.sqrt(self*self)
 
@@ -58,3 +62,9 @@ class vec2:
         n=self.norm()
         return vec2(self.x/n,self.y/n)
 
+    def rotated(self,angle):
+        # Same convention as QTransform.rotate: degrees, clockwise on a y-down screen
+        a=math.radians(angle)
+        c=math.cos(a)
+        s=math.sin(a)
+        return vec2(self.x*c-self.y*s,self.x*s+self.y*c)
@@ -0,0 +1,782 @@
+import math
+from collections import OrderedDict
+import numpy as np
+from vtypes import vec2
+from geometry import Edges, aabb, sat_pairs, ray_intersection, ray_intersections, build_edge_table, facing_edges
+from spatial import Grid
+from clock import SimClock
+import scenefile
+import distfield
+import stats
+
+RAD2DEG = 180.0 / 3.14159265358979
+ROBOT_SIZE = (40, 60)
+SENSOR_RANGE = 200.0
+MAX_SNAPSHOTS = 4096
+TOI_ITERATIONS = 16
+MAX_SWEEP_STEPS = 10000
+SENSOR_CACHE_SIZE = 256
+# Most rays one SCAN / SCANA may cast, so that a reply fits a datagram and a shared-memory slot
+MAX_SCAN_RAYS = 256
+# Per-robot arrays that change while running; scene geometry is not part of a snapshot
+STATE_ARRAYS = ('pose', 'start_pose', 'velocity', 'encoders', 'clicks', 'sensor_angle', 'collided', 'collision_time',
+                'penetration', 'distance', 'sensor_calls', 'sensor_hits', 'sensor_value', 'scan_calls', 'corners', 'robot_edges')
+
+
+def read_path_from_file(name):
+    try:
+        res = open(name, 'r').readline().strip()
+        if res.startswith('@'):
+            return read_path_from_file(res[1:])
+        return res
+    except FileNotFoundError:
+        return ''
+
+
+class Object:
+    def __init__(self):
+        self.poly = []
+        self.pos = vec2(0, 0)
+        self.radius = 0.0
+        self.edges = None
+
+
+class Obstacle(Object):
+    def __init__(self, x, y, w, h, angle, corners, edges):
+        # corners and edges come from the compiled scene arrays, see Obstacles
+        super(Obstacle, self).__init__()
+        self.pos = vec2(x, y)
+        self.poly = [vec2(c[0], c[1]) for c in corners]
+        self.radius = vec2(0.5 * w, 0.5 * h).norm()
+        self.edges = edges
+
+
+class Obstacles:
+    # The scene's obstacles as Obstacle objects, each built from the compiled arrays when first asked for;
+    # simulation only ever uses the arrays, so loading a large scene creates none
+    def __init__(self, params, corners, table):
+        self.params = params
+        self.corners = corners
+        self.table = table
+        self.items = [None] * len(params)
+
+    def __len__(self):
+        return len(self.items)
+
+    def __getitem__(self, i):
+        o = self.items[i]
+        if o is None:
+            o = self.items[i] = Obstacle(*self.params[i].tolist(), self.corners[i].tolist(),
+                                         Edges(self.table[4 * i:4 * i + 4]))
+        return o
+
+    def __iter__(self):
+        for i in range(len(self.items)):
+            yield self[i]
+
+
+def min_side(table):
+    # Shortest polygon side in an edge table, or infinity for an empty one
+    if len(table) == 0:
+        return np.inf
+    return float(np.hypot(table[:, 2] - table[:, 0], table[:, 3] - table[:, 1]).min())
+
+
+def integrate_one(pose, velocity, encoders, width, dt):
+    # integrate() for a single robot on plain floats, which beats NumPy's per-call overhead for one row.
+    # Returns the new pose and encoders and how far the robot travelled.
+    x, y, a = pose
+    pl = dt * velocity[0]
+    pr = dt * velocity[1]
+    dp = 0.5 * (pl + pr)
+    da = (pr - pl) / width
+    a0 = math.radians(a)
+    if abs(da) < 1e-9:
+        x += dp * math.sin(a0)
+        y -= dp * math.cos(a0)
+    else:
+        a1 = a0 - da
+        r = dp / da
+        x += r * (math.cos(a1) - math.cos(a0))
+        y += r * (math.sin(a1) - math.sin(a0))
+    return (x, y, a - da * RAD2DEG), (encoders[0] + pl, encoders[1] + pr), abs(dp)
+
+
+def rect_edge_rows(corners):
+    # build_edge_table() rows for one polygon given as a list of (x, y) corners, on plain floats. The side
+    # lengths come from np.hypot as there, since math.hypot rounds differently in the last place.
+    ends = corners[1:] + corners[:1]
+    lengths = np.hypot([x2 - x1 for (x1, y1), (x2, y2) in zip(corners, ends)],
+                       [y2 - y1 for (x1, y1), (x2, y2) in zip(corners, ends)]).tolist()
+    rows = []
+    for (x1, y1), (x2, y2), length in zip(corners, ends, lengths):
+        nx = -(y2 - y1) / length
+        ny = (x2 - x1) / length
+        rows.append((x1, y1, x2, y2, nx, ny, x1 * nx + y1 * ny))
+    return rows
+
+
+def integrate(pose, velocity, encoders, clicks, width, dt):
+    # Exact constant-curvature motion for every row: the wheel speeds are constant over the frame,
+    # so each robot follows an arc of radius v/w (or a straight line when w is zero).
+    # dt is a scalar or one step per row.
+    pl = dt * velocity[:, 0]
+    pr = dt * velocity[:, 1]
+    dp = 0.5 * (pl + pr)
+    da = (pr - pl) / width
+    a0 = np.radians(pose[:, 2])
+    a1 = a0 - da
+    straight = np.abs(da) < 1e-9
+    r = dp / np.where(straight, 1.0, da)
+    pose[:, 0] += np.where(straight, dp * np.sin(a0), r * (np.cos(a1) - np.cos(a0)))
+    pose[:, 1] += np.where(straight, -dp * np.cos(a0), r * (np.sin(a1) - np.sin(a0)))
+    pose[:, 2] -= da * RAD2DEG
+    start = np.floor(encoders)
+    encoders[:, 0] += pl
+    encoders[:, 1] += pr
+    clicks += (np.floor(encoders) - start).astype(clicks.dtype)
+    return np.abs(dp)
+
+
+class Robot:
+    # A handle on one row of the World's robot arrays
+    def __init__(self, world, id):
+        self.world = world
+        self.id = id
+        self.servo_pos = vec2(0, -20)
+        self.commands = {'V': self.command_velocity, 'SA': self.command_sensor_angle, 'S': self.command_sensor,
+                         'E': self.command_encoders, 'RESET': self.command_reset, 'SCAN': self.command_scan,
+                         'SCANA': self.command_scan_angles, 'T': self.command_time,
+                         'SNAP': self.command_snapshot, 'RESTORE': self.command_restore, 'DROP': self.command_drop}
+
+    @property
+    def pos(self):
+        return vec2(float(self.world.pose[self.id, 0]), float(self.world.pose[self.id, 1]))
+
+    @property
+    def angle(self):
+        return float(self.world.pose[self.id, 2])
+
+    @property
+    def sensor_angle(self):
+        return float(self.world.sensor_angle[self.id])
+
+    @property
+    def velocity(self):
+        return vec2(*self.world.velocity[self.id].tolist())
+
+    @velocity.setter
+    def velocity(self, v):
+        self.world.velocity[self.id] = (v[0], v[1])
+
+    @property
+    def encoders(self):
+        return vec2(*self.world.encoders[self.id].tolist())
+
+    @property
+    def encoder_clicks(self):
+        return tuple(self.world.clicks[self.id].tolist())
+
+    @encoder_clicks.setter
+    def encoder_clicks(self, clicks):
+        self.world.clicks[self.id] = clicks
+
+    @property
+    def start_pose(self):
+        return tuple(self.world.start_pose[self.id].tolist())
+
+    @property
+    def width(self):
+        return float(self.world.size[self.id, 0])
+
+    @property
+    def height(self):
+        return float(self.world.size[self.id, 1])
+
+    @property
+    def radius(self):
+        return float(self.world.radius[self.id])
+
+    @property
+    def collided(self):
+        return bool(self.world.collided[self.id])
+
+    @property
+    def distance(self):
+        return float(self.world.distance[self.id])
+
+    @property
+    def collision_time(self):
+        return float(self.world.collision_time[self.id])
+
+    @property
+    def penetration(self):
+        return float(self.world.penetration[self.id])
+
+    @property
+    def sensor_calls(self):
+        return int(self.world.sensor_calls[self.id])
+
+    @property
+    def sensor_hits(self):
+        return int(self.world.sensor_hits[self.id])
+
+    @property
+    def sensor_misses(self):
+        return int(self.world.sensor_calls[self.id] - self.world.sensor_hits[self.id])
+
+    @property
+    def scan_calls(self):
+        return int(self.world.scan_calls[self.id])
+
+    @property
+    def poly(self):
+        return [vec2(*p) for p in self.world.corners[self.id].tolist()]
+
+    @property
+    def edges(self):
+        return Edges(self.world.robot_edges[4 * self.id:4 * self.id + 4])
+
+    @property
+    def obstacles(self):
+        return self.world.obstacles
+
+    def restart(self):
+        self.world.pose[self.id] = self.world.start_pose[self.id]
+        self.world.velocity[self.id] = 0.0
+        self.world.encoders[self.id] = 0.0
+        self.world.clicks[self.id] = 0
+        self.world.sensor_angle[self.id] = 0.0
+        self.world.update_shape(self.id)
+
+    def process_command(self, cmd, args):
+        values = self.execute(cmd, args)
+        if values is None:
+            return ''
+        return ' '.join([cmd] + [str(v) for v in values])
+
+    def execute(self, cmd, args):
+        # Runs a command and returns its reply values, or None for commands that do not reply
+        if not cmd in self.commands:
+            return None
+        handler = self.commands.get(cmd)
+        if self.world.recorder:
+            self.world.recorder.log_command(self.id, cmd, args)
+        t = stats.clock()
+        result = handler(args)
+        stats.record('cmd.' + cmd, stats.clock() - t)
+        return result
+
+    def command_reset(self, args):
+        self.restart()
+
+    def command_velocity(self, args):
+        if len(args) == 2:
+            if abs(args[0]) <= 250 and abs(args[1]) <= 250:
+                self.velocity = vec2(args[0], args[1])
+
+    def command_sensor_angle(self, args):
+        if len(args) == 1:
+            self.set_sensor_angle(args[0])
+
+    def command_sensor(self, args):
+        return [self.sense()]
+
+    def sense(self):
+        # Readings are cached per robot and sensor angle together with the pose and world version they were
+        # taken at, so repeated reads between moves skip the ray cast; any motion or scene change misses
+        t = stats.clock()
+        world = self.world
+        world.sensor_calls[self.id] += 1
+        key = (self.id, world.sensor_angle.item(self.id))
+        pose = world.pose[self.id].tolist()
+        entry = world.sensor_cache.get(key)
+        if entry is not None and entry[0] == pose and entry[1] == world.version:
+            world.sensor_cache.move_to_end(key)
+            world.sensor_hits[self.id] += 1
+            world.sensor_value[self.id] = entry[2]
+            stats.record('sensor.hit', stats.clock() - t)
+            return entry[2]
+        distance = self.cast_sensor()
+        world.sensor_cache[key] = (pose, world.version, distance)
+        if len(world.sensor_cache) > SENSOR_CACHE_SIZE:
+            world.sensor_cache.popitem(last=False)
+        world.sensor_value[self.id] = distance
+        stats.record('sensor', stats.clock() - t)
+        return distance
+
+    def cast_sensor(self):
+        position = self.get_sensor_position()
+        direction = self.get_sensor_direction()
+        offset = 0.0
+        if self.world.field is not None:
+            # Skip the free space in front of the sensor, then cast exactly from where an obstacle is near
+            offset = self.world.field.march(position.x, position.y, direction.x, direction.y, SENSOR_RANGE)
+            position = position + direction * offset
+        minimum_distance = -1
+        length = SENSOR_RANGE - offset
+        if length > 0:
+            for t_exit, edges in self.world.index.ray_cells(position, direction, length):
+                if edges is not None:
+                    distance = ray_intersection(position, direction, length, edges)
+                    if distance >= 0 and (distance < minimum_distance or minimum_distance < 0):
+                        minimum_distance = distance
+                if 0 <= minimum_distance <= t_exit:
+                    break
+            if minimum_distance >= 0:
+                minimum_distance += offset
+        return float(minimum_distance)
+
+    def command_scan(self, args):
+        if len(args) != 3 or not all(math.isfinite(a) for a in args) or not 1 <= args[2] <= MAX_SCAN_RAYS:
+            return None
+        return self.scan(np.linspace(args[0], args[1], int(args[2]))).tolist()
+
+    def command_scan_angles(self, args):
+        if not args or len(args) > MAX_SCAN_RAYS or not all(math.isfinite(a) for a in args):
+            return None
+        return self.scan(args).tolist()
+
+    def scan(self, angles):
+        # Sweep the sensor over several angles (clamped to the servo range) and cast all rays in one batch
+        t = stats.clock()
+        self.world.scan_calls[self.id] += 1
+        a = np.radians(np.clip(np.asarray(angles, dtype=float), -45, 45))
+        x = 5 * np.sin(a) + self.servo_pos.x
+        y = -5 * np.cos(a) + self.servo_pos.y
+        ra = math.radians(self.angle)
+        c = math.cos(ra)
+        s = math.sin(ra)
+        starts = np.stack((x * c - y * s + self.pos.x, x * s + y * c + self.pos.y), axis=1)
+        a = a + ra
+        dirs = np.stack((np.sin(a), -np.cos(a)), axis=1)
+        offset = self.servo_pos.norm() + 5
+        reach = SENSOR_RANGE + offset
+        index = self.world.index
+        nearby = index.query(self.pos.x - reach, self.pos.y - reach, self.pos.x + reach, self.pos.y + reach)
+        edges = facing_edges(index.edges(nearby), self.pos, offset)
+        ranges = ray_intersections(starts, dirs, SENSOR_RANGE, edges)
+        stats.record('scan', stats.clock() - t)
+        return np.where(ranges >= 0, ranges, -1.0)
+
+    def command_time(self, args):
+        return [self.world.time]
+
+    def clearance(self):
+        # Distance from the robot's centre to the nearest obstacle
+        return float(self.world.clearance(self.world.pose[self.id:self.id + 1, 0:2])[0])
+
+    # Snapshots cover the whole world, whichever robot receives the command
+    def command_snapshot(self, args):
+        return [self.world.save_snapshot()]
+
+    def command_restore(self, args):
+        if len(args) != 1 or not math.isfinite(args[0]):
+            return None
+        return [1 if self.world.restore_snapshot(int(args[0])) else 0]
+
+    def command_drop(self, args):
+        for snapshot_id in args:
+            if math.isfinite(snapshot_id):
+                self.world.snapshots.pop(int(snapshot_id), None)
+
+    def command_encoders(self, args):
+        result = list(self.encoder_clicks)
+        self.encoder_clicks = (0, 0)
+        return result
+
+    def set_sensor_angle(self, a):
+        if 45 >= a >= -45:
+            self.world.sensor_angle[self.id] = a
+
+    def get_sensor_position(self):
+        p = vec2(0, -5).rotated(self.sensor_angle) + self.servo_pos
+        return p.rotated(self.angle) + self.pos
+
+    def get_sensor_direction(self):
+        return vec2(0, -1).rotated(self.sensor_angle + self.angle)
+
+    def get_heading(self):
+        return vec2(0, -1).rotated(self.angle)
+
+    def set_angle(self, a):
+        self.world.pose[self.id, 2] = a
+        self.world.update_shape(self.id)
+
+    def rotate(self, da):
+        self.set_angle(self.angle + da)
+
+    def set_pos(self, *args):
+        if len(args) == 2:
+            self.world.pose[self.id, 0:2] = args
+        elif len(args) == 1:
+            self.world.pose[self.id, 0:2] = (args[0][0], args[0][1])
+        self.world.update_shape(self.id)
+
+    def set_start_pose(self, x, y, a):
+        self.world.start_pose[self.id] = (x, y, a)
+        self.restart()
+
+    def advance(self, dt=None):
+        self.world.advance_robots(self.world.clock.dt if dt is None else dt, [self.id])
+
+
+class World:
+    def __init__(self, clock=None):
+        self.clock = clock or SimClock()
+        self.recorder = None
+        # Anything with publish(world), e.g. the shared-memory server, is handed the world after every step
+        self.telemetry = None
+        self.snapshots = OrderedDict()
+        self.next_snapshot = 1
+        # Bumped whenever the obstacles change, which invalidates cached sensor readings
+        self.version = 0
+        self.sensor_cache = OrderedDict()
+        self.lines = []
+        obstacles = np.array([(300.0, 100.0, 150.0, 30.0, 20.0)])
+        self.set_obstacles(obstacles, scenefile.obstacle_corners(obstacles))
+        # Optional signed distance field over the obstacles; 0 resolution disables it
+        self.scene_path = ''
+        self.field_resolution = 0.0
+        self.field = None
+        self.robots = []
+        self.pose = np.zeros((0, 3))
+        self.start_pose = np.zeros((0, 3))
+        self.velocity = np.zeros((0, 2))
+        self.encoders = np.zeros((0, 2))
+        self.clicks = np.zeros((0, 2), dtype=np.int64)
+        self.sensor_angle = np.zeros(0)
+        self.size = np.zeros((0, 2))
+        self.local_corners = np.zeros((0, 4, 2))
+        self.radius = np.zeros(0)
+        self.collided = np.zeros(0, dtype=bool)
+        self.collision_time = np.zeros(0)
+        self.penetration = np.zeros(0)
+        self.distance = np.zeros(0)
+        self.sensor_calls = np.zeros(0, dtype=np.int64)
+        self.sensor_hits = np.zeros(0, dtype=np.int64)
+        self.sensor_value = np.zeros(0)
+        self.scan_calls = np.zeros(0, dtype=np.int64)
+        self.corners = np.zeros((0, 4, 2))
+        self.robot_edges = np.zeros((0, 7))
+        self.add_robot(150, 150, 0)
+
+    @property
+    def time(self):
+        return self.clock.time
+
+    @property
+    def robot(self):
+        return self.robots[0]
+
+    @property
+    def over(self):
+        return bool(self.collided.all())
+
+    def add_robot(self, x, y, a, size=ROBOT_SIZE):
+        self.pose = np.concatenate((self.pose, [(x, y, a)]))
+        self.start_pose = np.concatenate((self.start_pose, [(x, y, a)]))
+        self.velocity = np.concatenate((self.velocity, [(0.0, 0.0)]))
+        self.encoders = np.concatenate((self.encoders, [(0.0, 0.0)]))
+        self.clicks = np.concatenate((self.clicks, np.zeros((1, 2), dtype=np.int64)))
+        self.sensor_angle = np.append(self.sensor_angle, 0.0)
+        self.size = np.concatenate((self.size, [size]))
+        w, h = 0.5 * size[0], 0.5 * size[1]
+        self.local_corners = np.concatenate((self.local_corners, [((-w, -h), (w, -h), (w, h), (-w, h))]))
+        self.update_sizes()
+        self.collided = np.append(self.collided, False)
+        self.collision_time = np.append(self.collision_time, np.nan)
+        self.penetration = np.append(self.penetration, 0.0)
+        self.distance = np.append(self.distance, 0.0)
+        self.sensor_calls = np.append(self.sensor_calls, 0)
+        self.sensor_hits = np.append(self.sensor_hits, 0)
+        self.sensor_value = np.append(self.sensor_value, -1.0)
+        self.scan_calls = np.append(self.scan_calls, 0)
+        self.corners = np.concatenate((self.corners, np.zeros((1, 4, 2))))
+        self.robot_edges = np.concatenate((self.robot_edges, np.zeros((4, 7))))
+        robot = Robot(self, len(self.robots))
+        self.robots.append(robot)
+        robot.restart()
+        return robot
+
+    def truncate_robots(self, count):
+        count = max(count, 1)
+        for name in ('pose', 'start_pose', 'velocity', 'encoders', 'clicks', 'sensor_angle', 'size',
+                     'local_corners', 'radius', 'collided', 'collision_time', 'penetration', 'distance',
+                     'sensor_calls', 'sensor_hits', 'sensor_value', 'scan_calls', 'corners'):
+            setattr(self, name, getattr(self, name)[:count].copy())
+        self.robot_edges = self.robot_edges[:4 * count].copy()
+        del self.robots[count:]
+        self.update_sizes()
+
+    def update_sizes(self):
+        self.radius = 0.5 * np.hypot(self.size[:, 0], self.size[:, 1])
+        # For sweep_steps: how much faster than the wheels a corner can move, and the thinnest robot side
+        self.corner_speed = float((1 + 2 * self.radius / self.size[:, 0]).max())
+        self.min_robot_side = float(self.size.min())
+
+    def update_shapes(self, ids=slice(None)):
+        pose = self.pose[ids]
+        a = np.radians(pose[:, 2:3])
+        c = np.cos(a)
+        s = np.sin(a)
+        local = self.local_corners[ids]
+        corners = np.empty(local.shape)
+        corners[:, :, 0] = local[:, :, 0] * c - local[:, :, 1] * s + pose[:, 0:1]
+        corners[:, :, 1] = local[:, :, 0] * s + local[:, :, 1] * c + pose[:, 1:2]
+        self.corners[ids] = corners
+        self.robot_edges.reshape(-1, 4, 7)[ids] = build_edge_table(corners).reshape(-1, 4, 7)
+
+    def restart(self):
+        self.clock.reset()
+        self.collided[:] = False
+        self.collision_time[:] = np.nan
+        self.penetration[:] = 0.0
+        self.distance[:] = 0.0
+        self.sensor_calls[:] = 0
+        self.sensor_hits[:] = 0
+        self.sensor_value[:] = -1.0
+        self.sensor_cache.clear()
+        self.scan_calls[:] = 0
+        for robot in self.robots:
+            robot.restart()
+
+    def snapshot(self):
+        # Copies of every dynamic array plus the clock; cheap enough to take thousands per second
+        return (len(self.robots), (self.clock.base, self.clock.ticks, self.clock.dt),
+                [getattr(self, name).copy() for name in STATE_ARRAYS])
+
+    def restore(self, snapshot):
+        # Returns False if the robot count has changed since the snapshot was taken
+        count, clock, arrays = snapshot
+        if count != len(self.robots):
+            return False
+        for name, a in zip(STATE_ARRAYS, arrays):
+            getattr(self, name)[...] = a
+        self.clock.base, self.clock.ticks, self.clock.dt = clock
+        self.clock.rebase()
+        return True
+
+    def save_snapshot(self):
+        # Keeps a snapshot under a numeric id for the SNAP / RESTORE commands, dropping the oldest beyond MAX_SNAPSHOTS
+        snapshot_id = self.next_snapshot
+        self.next_snapshot += 1
+        self.snapshots[snapshot_id] = self.snapshot()
+        if len(self.snapshots) > MAX_SNAPSHOTS:
+            self.snapshots.popitem(last=False)
+        return snapshot_id
+
+    def restore_snapshot(self, snapshot_id):
+        snapshot = self.snapshots.get(snapshot_id)
+        return snapshot is not None and self.restore(snapshot)
+
+    def process_command(self, cmd, args, robot=0):
+        if robot < 0 or robot >= len(self.robots):
+            return ''
+        return self.robots[robot].process_command(cmd, args)
+
+    def execute(self, cmd, args, robot=0):
+        if robot < 0 or robot >= len(self.robots):
+            return None
+        return self.robots[robot].execute(cmd, args)
+
+    def load_scene(self, path):
+        obstacles, corners, lines, poses = scenefile.load_scene(path)
+        self.snapshots.clear()
+        self.version += 1
+        self.sensor_cache.clear()
+        self.set_obstacles(obstacles, corners)
+        self.lines = [tuple(line) for line in lines.tolist()]
+        poses = poses.tolist()
+        self.scene_path = path
+        self.build_field()
+        if poses:
+            self.truncate_robots(len(poses))
+            for i, p in enumerate(poses):
+                if i < len(self.robots):
+                    self.robots[i].set_start_pose(*p)
+                else:
+                    self.add_robot(*p)
+
+    def set_obstacles(self, obstacles, corners):
+        # obstacles is an (n, 5) array of x, y, w, h, angle rows and corners their (n, 4, 2) corners
+        table = build_edge_table(corners)
+        self.obstacles = Obstacles(obstacles, corners, table)
+        self.index = Grid(corners, table)
+        self.min_obstacle_side = min_side(table)
+        self.obstacle_corners = corners
+
+    def set_field_resolution(self, resolution):
+        self.field_resolution = resolution
+        self.build_field()
+
+    def build_field(self):
+        self.field = None
+        if self.field_resolution > 0:
+            self.field = distfield.load_field(self.scene_path, self.obstacle_corners, self.field_resolution)
+
+    def clearance(self, points):
+        # Signed distance from (m, 2) points to the nearest obstacle: a field lookup when there is one,
+        # otherwise computed exactly against every obstacle
+        points = np.asarray(points, dtype=float).reshape(-1, 2)
+        if self.field is not None:
+            return self.field.sample(points)
+        return distfield.rect_distance(points, self.obstacle_corners)
+
+    def advance_robots(self, dt, ids=slice(None)):
+        t = stats.clock()
+        single = len(self.robots) == 1 if isinstance(ids, slice) else len(ids) == 1
+        if single:
+            # A lone robot, the common case, is stepped on plain floats rather than through the batch arrays
+            i = 0 if isinstance(ids, slice) else int(ids[0])
+            self.advance_one(i, float(dt) if np.isscalar(dt) else float(dt[0]))
+            stats.record('kinematics', stats.clock() - t)
+            return
+        pose = self.pose[ids]
+        encoders = self.encoders[ids]
+        clicks = self.clicks[ids]
+        self.distance[ids] += integrate(pose, self.velocity[ids], encoders, clicks, self.size[ids, 0], dt)
+        self.pose[ids] = pose
+        self.encoders[ids] = encoders
+        self.clicks[ids] = clicks
+        self.update_shapes(ids)
+        stats.record('kinematics', stats.clock() - t)
+
+    def advance_one(self, i, dt):
+        start = self.encoders[i].tolist()
+        pose, encoders, distance = integrate_one(self.pose[i].tolist(), self.velocity[i].tolist(), start,
+                                                 self.size.item(i, 0), dt)
+        self.clicks[i] += (math.floor(encoders[0]) - math.floor(start[0]),
+                           math.floor(encoders[1]) - math.floor(start[1]))
+        self.pose[i] = pose
+        self.encoders[i] = encoders
+        self.distance[i] += distance
+        self.update_shape(i)
+
+    def update_shape(self, i):
+        # update_shapes() for one robot
+        x, y, a = self.pose[i].tolist()
+        a = math.radians(a)
+        c = math.cos(a)
+        s = math.sin(a)
+        corners = [(px * c - py * s + x, px * s + py * c + y) for px, py in self.local_corners[i].tolist()]
+        self.corners[i] = corners
+        self.robot_edges[4 * i:4 * i + 4] = rect_edge_rows(corners)
+
+    def find_contacts(self, ids):
+        # For each robot in ids, how deep its footprint penetrates an obstacle or another robot (0 when free).
+        # Broad phase per robot through the grid and then by bounding box, followed by one batched
+        # separating-axis test over every remaining (robot, obstacle) pair and every pair of robots whose
+        # bounding circles overlap.
+        t = stats.clock()
+        robots = self.robot_edges.reshape(-1, 4, 7)
+        depth = np.zeros(len(ids))
+        tables = []
+        owners = []
+        candidates = range(len(ids))
+        if self.field is not None:
+            # A robot whose centre is further from every obstacle than its bounding radius touches none, and
+            # then the grid and narrow phase are skipped altogether
+            if len(ids) == 1:
+                x, y = self.pose[ids[0], 0:2].tolist()
+                candidates = [] if self.field.safe_distance_at(x, y) > self.radius.item(ids[0]) else [0]
+            else:
+                candidates = np.nonzero(self.field.safe_distance(self.pose[ids, 0:2]) <= self.radius[ids])[0]
+        if len(candidates):
+            lo = self.corners[ids].min(axis=1)
+            hi = self.corners[ids].max(axis=1)
+        for k in candidates:
+            for cell in self.index.query_edges(lo[k, 0], lo[k, 1], hi[k, 0], hi[k, 1]):
+                tables.append(cell.table)
+                owners.append(np.full(len(cell) // 4, k))
+        if tables:
+            # Obstacles are rectangles, so each cell table is a run of 4-row polygons
+            polys = np.concatenate(tables).reshape(-1, 4, 7)
+            owner = np.concatenate(owners)
+            plo, phi = aabb(polys)
+            near = (plo <= hi[owner]).all(axis=1) & (phi >= lo[owner]).all(axis=1)
+            if near.any():
+                owner = owner[near]
+                np.maximum.at(depth, owner, np.maximum(sat_pairs(robots[ids[owner]], polys[near]), 0))
+        if len(self.robots) > 1:
+            delta = self.pose[ids, None, 0:2] - self.pose[None, :, 0:2]
+            close = np.hypot(delta[:, :, 0], delta[:, :, 1]) <= self.radius[ids, None] + self.radius[None, :]
+            close[np.arange(len(ids)), ids] = False
+            k, j = np.nonzero(close)
+            if len(k):
+                np.maximum.at(depth, k, np.maximum(sat_pairs(robots[ids[k]], robots[j]), 0))
+        stats.record('collision', stats.clock() - t)
+        return depth
+
+    def check_intersections(self):
+        ids = np.nonzero(~self.collided)[0]
+        depth = self.find_contacts(ids)
+        hit = depth > 0
+        if hit.any():
+            self.set_collided(ids[hit], depth=depth[hit])
+
+    def set_collided(self, ids, times=None, depth=None):
+        keep = ~self.collided[ids]
+        ids = ids[keep]
+        self.collided[ids] = True
+        self.collision_time[ids] = self.time if times is None else np.asarray(times)[keep]
+        if depth is not None:
+            self.penetration[ids] = np.asarray(depth)[keep]
+
+    def sweep_steps(self, dt, ids):
+        # Sub-steps needed so that no robot corner moves more than half the thinnest obstacle or robot side
+        # per sub-step; then a robot cannot pass through a wall between two collision tests
+        # A corner moves at most |dp| + |da| * radius <= dt * vmax * (1 + 2 * radius / width)
+        motion = dt * float(np.abs(self.velocity).max()) * self.corner_speed
+        step = 0.5 * min(self.min_obstacle_side, self.min_robot_side)
+        if motion <= step:
+            return 1
+        return int(min(math.ceil(motion / step), MAX_SWEEP_STEPS))
+
+    def resolve_impacts(self, ids, state, dt, start_time, depth):
+        # ids were free at state and touch something dt later, by depth: bisect each one's time of impact,
+        # leave it at the last free pose found and record the contact time, with the penetration at the
+        # first touching pose found rather than at the end of the overshooting step
+        pose, encoders, clicks, distance = state
+        lo = np.zeros(len(ids))
+        hi = np.ones(len(ids))
+        for i in range(TOI_ITERATIONS + 1):
+            f = lo if i == TOI_ITERATIONS else 0.5 * (lo + hi)
+            self.pose[ids] = pose[ids]
+            self.encoders[ids] = encoders[ids]
+            self.clicks[ids] = clicks[ids]
+            self.distance[ids] = distance[ids]
+            self.advance_robots(dt * f, ids)
+            if i < TOI_ITERATIONS:
+                contact = self.find_contacts(ids)
+                touching = contact > 0
+                hi = np.where(touching, f, hi)
+                lo = np.where(touching, lo, f)
+                depth = np.where(touching, contact, depth)
+        self.set_collided(ids, start_time + dt * hi, depth)
+
+    def advance(self, dt=None):
+        # dt defaults to the clock's step; simulated time only ever moves forward here
+        if self.over:
+            return False
+        dt = self.clock.dt if dt is None else dt
+        ids = np.nonzero(~self.collided)[0]
+        start_time = self.time
+        steps = self.sweep_steps(dt, ids)
+        sub_dt = dt / steps
+        for k in range(steps):
+            state = (self.pose.copy(), self.encoders.copy(), self.clicks.copy(), self.distance.copy())
+            self.advance_robots(sub_dt, ids if len(ids) < len(self.robots) else slice(None))
+            depth = self.find_contacts(ids)
+            hit = depth > 0
+            if hit.any():
+                self.resolve_impacts(ids[hit], state, sub_dt, start_time + k * sub_dt, depth[hit])
+                ids = ids[~hit]
+                if len(ids) == 0:
+                    break
+        self.clock.tick(dt)
+        if self.recorder:
+            self.recorder.capture()
+        if self.telemetry:
+            self.telemetry.publish(self)
+        return True